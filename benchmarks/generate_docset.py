@@ -0,0 +1,194 @@
+""" Generates a synthetic docset for benchmarking extract_coderefs.py: a git repository with
+articles that contain :::code references to sample repositories, a docfx.json with fileMetadata
+globs, an .openpublishing.publish.config.json, and a commit history. It can also generate bare
+sample repositories with the referenced files, to serve as file:// remotes for the mirror
+backend."""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+
+def article_path(index, articles_per_folder):
+    folder = index // articles_per_folder
+    return f"articles/area{folder % 10}/topic{folder}/article{index}.md"
+
+
+def article_content(rng, index, refs, repos, files_per_repo, revision):
+    date = datetime.date(2019, 1, 1) + datetime.timedelta(days=rng.randrange(1500))
+    lines = ["---", f"title: Article {index}", f"description: Synthetic article {index}",
+        f"ms.date: {date.strftime('%m/%d/%Y')}", "ms.topic: how-to", "---", "", f"# Article {index}", ""]
+
+    for r in range(refs):
+        lines.append(f"Paragraph {r} of the article, revision {revision}, with some text about the sample below.")
+        lines.append("")
+
+        repo = rng.randrange(repos)
+        path = f"src/module{rng.randrange(files_per_repo) // 10}/file{rng.randrange(files_per_repo)}.py"
+        kind = rng.randrange(3)
+
+        if kind == 0:
+            selector = f' id="snippet{r}"'
+        elif kind == 1:
+            selector = f' range="{r + 1}-{r + 10}"'
+        else:
+            selector = ""
+
+        prefix = "~/.." if rng.randrange(4) == 0 else "~"
+        lines.append(f':::code language="python" source="{prefix}/samples{repo}/{path}"{selector}:::')
+        lines.append("")
+
+    lines.append("Closing text.")
+    return "\n".join(lines) + "\n"
+
+
+def sample_paths(files_per_repo):
+    """ Returns every path that article_content can reference in a sample repository."""
+    return [f"src/module{m}/file{f}.py" for m in range((files_per_repo - 1) // 10 + 1) for f in range(files_per_repo)]
+
+
+def sample_content(path, revision, snippets=5):
+    """ Returns the content of a sample file at a revision (0 for the first). The file has the
+    regions that article_content references by id, the same lines in range selectors, and
+    region snippet{s} changes every s + 2 revisions, while the first line changes in each."""
+    lines = [f"# {path}, revision {revision}"]
+
+    for s in range(snippets):
+        lines += [f"# <snippet{s}>", f"value{s} = {revision // (s + 2)}", f"# </snippet{s}>"]
+
+    return "\n".join(lines) + "\n"
+
+
+def generate_sample_repos(folder, repos=5, files_per_repo=100, commits=200, seed=1):
+    """ Creates bare repositories folder/Azure-Samples/sample-repo-{r}.git, matching the
+    dependent_repositories of generate_docset, whose main branch has commits that each change
+    a few of the files that articles reference."""
+    rng = random.Random(seed)
+    start = datetime.datetime(2018, 1, 1, tzinfo=datetime.timezone.utc)
+    paths = sample_paths(files_per_repo)
+
+    for r in range(repos):
+        repo_folder = os.path.join(folder, "Azure-Samples", f"sample-repo-{r}.git")
+        os.makedirs(repo_folder)
+        subprocess.run(["git", "init", "-q", "--bare", repo_folder], check=True)
+        stream = []
+
+        for number in range(commits):
+            timestamp = int((start + datetime.timedelta(days=number * 10 + rng.randrange(10))).timestamp())
+            message = f"Sample commit {number}"
+            stream.append(f"commit refs/heads/main\nauthor Bench <bench@example.com> {timestamp} +0000\n")
+            stream.append(f"committer Bench <bench@example.com> {timestamp} +0000\n")
+            stream.append(f"data {len(message)}\n{message}\n")
+
+            for path in (paths if number == 0 else rng.sample(paths, min(len(paths), 20))):
+                content = sample_content(path, number)
+                stream.append(f"M 100644 inline {path}\ndata {len(content)}\n{content}\n")
+
+        subprocess.run(["git", "fast-import", "--quiet"], cwd=repo_folder, input="".join(stream).encode(), check=True)
+
+
+def generate_docset(folder, articles=1000, refs_per_article=3, globs=50, commits=200,
+        repos=5, files_per_repo=100, articles_per_folder=25, seed=1):
+    """ Creates the docset in folder, which must not exist, and returns a config.json content entry
+    for it."""
+    rng = random.Random(seed)
+    os.makedirs(folder)
+    subprocess.run(["git", "init", "-q", folder], check=True)
+
+    # Articles without references are the common case, so only some articles get them.
+    with_refs = set(rng.sample(range(articles), max(1, articles // 3)))
+    contents = {}
+
+    for index in range(articles):
+        refs = refs_per_article if index in with_refs else 0
+        article_rng = random.Random(seed * 100003 + index)
+        contents[article_path(index, articles_per_folder)] = article_content(article_rng, index, refs, repos, files_per_repo, 0)
+
+    file_metadata = {"ms.service": {"**/*.md": "azure"}, "ms.author": {"**/*.md": "docsauthor"}}
+
+    for g in range(globs):
+        field = ["ms.service", "ms.author", "ms.subservice", "ms.reviewer"][g % 4]
+        value = f"{field.split('.')[1]}{g}"
+        folders = articles // articles_per_folder + 1
+
+        if g % 3 == 0:
+            spec = f"area{g % 10}/**/*.md"
+        elif g % 3 == 1:
+            spec = f"area{g % 10}/topic{rng.randrange(folders)}/*.md"
+        else:
+            spec = f"**/topic{rng.randrange(folders)}/**"
+
+        file_metadata.setdefault(field, {})[spec] = value
+
+    contents["articles/docfx.json"] = json.dumps({"build": {"content": [{"files": ["**/*.md"]}],
+        "fileMetadata": file_metadata}}, indent=4)
+    contents[".openpublishing.publish.config.json"] = json.dumps({"dependent_repositories": [
+        {"path_to_root": f"samples{r}", "url": f"https://github.com/Azure-Samples/sample-repo-{r}", "branch": "main"}
+        for r in range(repos)]}, indent=4)
+
+    # Build the history with git fast-import: one commit with everything, then commits that
+    # each revise a few articles, a day apart. Revisions keep an article's references.
+    stream = []
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    paths = sorted(contents)
+
+    def commit(number, changes):
+        timestamp = int((start + datetime.timedelta(days=number)).timestamp())
+        message = f"Commit {number}"
+        stream.append(f"commit refs/heads/main\ncommitter Bench <bench@example.com> {timestamp} +0000\n")
+        stream.append(f"data {len(message)}\n{message}\n")
+
+        for path, content in changes:
+            # Generated content is ASCII, so its length in characters is its length in bytes.
+            stream.append(f"M 100644 inline {path}\ndata {len(content)}\n{content}\n")
+
+    commit(0, [(path, contents[path]) for path in paths])
+    article_paths = [path for path in paths if path.endswith(".md")]
+
+    for number in range(1, commits):
+        changes = []
+
+        for path in rng.sample(article_paths, min(len(article_paths), rng.randrange(1, 6))):
+            index = int(path.rsplit("article", 1)[1][:-3])
+            refs = refs_per_article if index in with_refs else 0
+            contents[path] = article_content(random.Random(seed * 100003 + index), index, refs, repos, files_per_repo, number)
+            changes.append((path, contents[path]))
+
+        commit(number, changes)
+
+    subprocess.run(["git", "fast-import", "--quiet"], cwd=folder, input="".join(stream).encode(), check=True)
+    subprocess.run(["git", "checkout", "-q", "-f", "main"], cwd=folder, check=True)
+
+    return {
+        "repo": f"Bench/{os.path.basename(folder)}",
+        "disabled": False,
+        "path": os.path.abspath(folder),
+        "opc_folder": "",
+        "docfx_folder": "articles",
+        "url": "https://docs.example.com/bench",
+        "exclude_folders": ["media"]
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("folder", help="Folder to create for the docset")
+    parser.add_argument("--articles", type=int, default=1000, help="Number of articles")
+    parser.add_argument("--refs", type=int, default=3, help=":::code references per article that has them")
+    parser.add_argument("--globs", type=int, default=50, help="Number of docfx fileMetadata globs")
+    parser.add_argument("--commits", type=int, default=200, help="Number of commits in the history")
+    parser.add_argument("--repos", type=int, default=5, help="Number of sample repositories")
+    parser.add_argument("--files", type=int, default=100, help="Number of referenced files per sample repository")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    parser.add_argument("--sample-repos", help="Also create bare sample repositories in this folder")
+    args = parser.parse_args()
+
+    entry = generate_docset(args.folder, args.articles, args.refs, args.globs, args.commits,
+        args.repos, args.files, seed=args.seed)
+
+    if args.sample_repos:
+        generate_sample_repos(args.sample_repos, args.repos, args.files, args.commits, args.seed)
+
+    print(json.dumps({"content": [entry]}, indent=4))
@@ -0,0 +1,298 @@
+""" A local stand-in for the GitHub commits API, for benchmarking and testing extract_coderefs.py
+offline. It serves deterministic commit histories for any file with configurable latency and
+rate limit headers, and answers conditional requests with 304. The since, until, per_page, and
+page parameters are supported, with Link headers for pagination. The same histories are
+available through a minimal GraphQL endpoint at /graphql that answers the history queries of
+the graphql backend, with authored dates in their authors' time zones, as GitHub gives them. The contents and git blobs APIs serve each file as of each commit in its
+history, with the content of generate_docset.sample_content. Point the script at it with
+GITHUB_API_URL=http://127.0.0.1:<port>."""
+
+import argparse
+import base64
+import datetime
+import hashlib
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+from generate_docset import sample_content
+
+def stub_commits(owner, repo, branch, path, max_commits=40):
+    """ Returns a deterministic, newest-first list of commits for a file in the form of the
+    GitHub commits API."""
+    seed = zlib.crc32(f"{owner}/{repo}/{branch}/{path}".encode())
+    count = 1 + seed % max_commits
+    date = datetime.datetime(2024, 6, 1, 12, tzinfo=datetime.timezone.utc)
+    commits = []
+
+    for i in range(count):
+        date -= datetime.timedelta(days=1 + (seed >> (i % 24)) % 45)
+        sha = "%040x" % zlib.crc32(f"{seed}/{i}".encode())
+        commits.append({
+            "sha": sha,
+            "html_url": f"https://github.com/{owner}/{repo}/commit/{sha}",
+            "commit": {"author": {"name": "Stub", "date": date.strftime("%Y-%m-%dT%H:%M:%SZ")}}
+        })
+
+    return commits
+
+
+# UTC offsets in minutes of the authors of GraphQL commits, which vary by commit
+AUTHOR_OFFSETS = [0, -7 * 60, 5 * 60 + 30, 13 * 60]
+
+def get_git_timestamp(commit):
+    """ Returns the authored date of a commit from stub_commits as a GraphQL GitTimestamp, which
+    keeps its author's UTC offset rather than converting to UTC."""
+    date = commit["commit"]["author"]["date"]
+    offset = AUTHOR_OFFSETS[int(commit["sha"], 16) % len(AUTHOR_OFFSETS)]
+
+    if 0 == offset:
+        return date
+
+    dt = datetime.datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+    return dt.astimezone(datetime.timezone(datetime.timedelta(minutes=offset))).isoformat()
+
+
+class StubState:
+    def __init__(self, latency=0.0, rate_limit=5000, window=3600, max_commits=40):
+        self.latency = latency
+        self.max_commits = max_commits
+        self.rate_limit = rate_limit
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset = time.time() + window
+        self.remaining = rate_limit
+        self.requests = 0
+        self.not_modified = 0
+        self.rejected = 0
+        self.blobs_served = 0
+
+        # The blobs served from the contents API by SHA, for the blobs API
+        self.blobs = {}
+
+    def take(self):
+        """ Counts a request against the rate limit; returns False if the budget is spent."""
+        with self.lock:
+            self.requests += 1
+
+            if time.time() >= self.reset:
+                self.reset = time.time() + self.window
+                self.remaining = self.rate_limit
+
+            if self.remaining <= 0:
+                self.rejected += 1
+                return False
+
+            self.remaining -= 1
+            return True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def rate_limit_headers(self):
+        state = self.server.state
+        return {"X-RateLimit-Limit": str(state.rate_limit), "X-RateLimit-Remaining": str(state.remaining),
+            "X-RateLimit-Reset": str(int(state.reset))}
+
+    def do_GET(self):
+        state = self.server.state
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+
+        if state.latency > 0:
+            time.sleep(state.latency)
+
+        query = parse_qs(url.query)
+
+        if len(parts) > 4 and parts[0] == "repos" and parts[3] == "contents":
+            self.send_contents(parts[1], parts[2], unquote("/".join(parts[4:])), query.get("ref", ["main"])[0])
+            return
+
+        if len(parts) == 6 and parts[0] == "repos" and parts[3:5] == ["git", "blobs"]:
+            self.send_blob(parts[5])
+            return
+
+        if len(parts) != 4 or parts[0] != "repos" or parts[3] != "commits":
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        commits = stub_commits(parts[1], parts[2], query.get("sha", ["main"])[0], query.get("path", [""])[0], state.max_commits)
+        since = query.get("since", [""])[0]
+        until = query.get("until", ["9999"])[0]
+
+        # Dates have the same format, so they compare as strings.
+        commits = [commit for commit in commits if since <= commit["commit"]["author"]["date"] <= until]
+        per_page = min(100, int(query.get("per_page", ["30"])[0]))
+        page = int(query.get("page", ["1"])[0])
+        more = len(commits) > page * per_page
+        commits = commits[(page - 1) * per_page : page * per_page]
+        etag = '"%08x"' % zlib.crc32(json.dumps(commits).encode())
+
+        # As on GitHub, a 304 doesn't count against the rate limit.
+        if self.headers.get("If-None-Match") == etag:
+            with state.lock:
+                state.requests += 1
+                state.not_modified += 1
+
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if not state.take():
+            self.send_json(403, {"message": "API rate limit exceeded"}, self.rate_limit_headers())
+            return
+
+        headers = self.rate_limit_headers()
+        headers["ETag"] = etag
+
+        if more:
+            next_query = "&".join(f"{key}={value[0]}" for key, value in query.items() if key != "page")
+            headers["Link"] = f'<http://{self.headers.get("Host")}{url.path}?{next_query}&page={page + 1}>; rel="next"'
+
+        self.send_json(200, commits, headers)
+
+    def send_contents(self, owner, repo, path, ref):
+        """ Sends the file as of commit ref (a SHA or branch) on the main branch, whose revision
+        is the commit's position in the file's history, the oldest being 0."""
+        state = self.server.state
+        commits = stub_commits(owner, repo, "main", path, state.max_commits)
+        shas = [commit["sha"] for commit in commits]
+
+        if ref == "main":
+            ref = shas[0]
+
+        if not ref in shas:
+            self.send_json(404, {"message": "No commit found for the ref " + ref})
+            return
+
+        if not state.take():
+            self.send_json(403, {"message": "API rate limit exceeded"}, self.rate_limit_headers())
+            return
+
+        content = sample_content(path, len(shas) - 1 - shas.index(ref)).encode()
+        sha = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+        with state.lock:
+            state.blobs[sha] = content
+            state.blobs_served += 1
+
+        self.send_json(200, {"type": "file", "path": path, "sha": sha, "size": len(content), "encoding": "base64",
+            "content": base64.b64encode(content).decode()}, self.rate_limit_headers())
+
+    def send_blob(self, sha):
+        state = self.server.state
+
+        if not sha in state.blobs:
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        if not state.take():
+            self.send_json(403, {"message": "API rate limit exceeded"}, self.rate_limit_headers())
+            return
+
+        with state.lock:
+            state.blobs_served += 1
+
+        content = state.blobs[sha]
+        self.send_json(200, {"sha": sha, "size": len(content), "encoding": "base64",
+            "content": base64.b64encode(content).decode()}, self.rate_limit_headers())
+
+
+    def do_POST(self):
+        state = self.server.state
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+        if state.latency > 0:
+            time.sleep(state.latency)
+
+        if urlparse(self.path).path.rstrip("/") != "/graphql":
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        if not state.take():
+            self.send_json(403, {"message": "API rate limit exceeded"}, self.rate_limit_headers())
+            return
+
+        # Answer each aliased history(...) connection in the query with the same commits the
+        # REST endpoint serves for that path.
+        variables = body.get("variables", {})
+        owner, name, branch = variables.get("owner"), variables.get("name"), variables.get("branch")
+        histories = {}
+
+        for alias, arguments in re.findall(r"(\w+): history\(([^)]*)\)", body.get("query", "")):
+            args = {}
+
+            for argument in arguments.split(","):
+                key, value = [part.strip() for part in argument.split(":", 1)]
+                args[key] = variables.get(value[1:]) if value.startswith("$") else json.loads(value)
+
+            commits = stub_commits(owner, name, branch, args.get("path", ""), state.max_commits)
+            commits = [commit for commit in commits if commit["commit"]["author"]["date"] >= (args.get("since") or "")]
+
+            # Cursors are offsets into the history.
+            start = int(args.get("after") or 0)
+            end = start + args.get("first", 100)
+            histories[alias] = {"nodes": [{"oid": commit["sha"], "url": commit["html_url"],
+                "authoredDate": get_git_timestamp(commit)} for commit in commits[start:end]]}
+
+            # As on GitHub, pageInfo is only there when asked for, which the paginated form does.
+            if "after" in args:
+                histories[alias]["pageInfo"] = {"hasNextPage": len(commits) > end, "endCursor": str(end)}
+
+        data = {
+            "rateLimit": {"cost": 1, "remaining": state.remaining, "resetAt":
+                datetime.datetime.fromtimestamp(state.reset, datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")},
+            "repository": {"object": histories}
+        }
+
+        self.send_json(200, {"data": data}, self.rate_limit_headers())
+
+
+def start_stub(port=0, latency=0.0, rate_limit=5000, window=3600, max_commits=40):
+    """ Starts the stub on a background thread and returns the server; server.server_address
+    gives the port when port is 0, and server.state the request counts."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(latency, rate_limit, window, max_commits)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds to delay each response")
+    parser.add_argument("--rate-limit", type=int, default=5000, help="Requests allowed per window")
+    parser.add_argument("--window", type=int, default=3600, help="Rate limit window in seconds")
+    parser.add_argument("--max-commits", type=int, default=40, help="Most commits in a file's history")
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.latency, args.rate_limit, args.window, args.max_commits)
+    print(f"GitHub API stub listening on http://127.0.0.1:{server.server_address[1]}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
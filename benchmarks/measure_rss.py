@@ -0,0 +1,36 @@
+""" Runs a Python script in this process, as if it were run directly, and writes its peak memory
+to a JSON file when it exits: peak_rss_mb for the script's own process, and peak_child_rss_mb
+for the largest of the processes it waited for, such as --jobs workers and git. Not available
+on Windows.
+
+Usage: python measure_rss.py <output-json-file> <script> [<script arguments>]"""
+
+import json
+import os
+import resource
+import runpy
+import sys
+
+def get_peak_rss_mb(who):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+
+    output_file, script = sys.argv[1], os.path.abspath(sys.argv[2])
+
+    # The script sees its own arguments and imports modules from its own folder.
+    sys.argv = sys.argv[2:]
+    sys.path[0] = os.path.dirname(script)
+
+    try:
+        runpy.run_path(script, run_name="__main__")
+    finally:
+        with open(output_file, "w") as peaks_file:
+            json.dump({"peak_rss_mb": get_peak_rss_mb(resource.RUSAGE_SELF),
+                "peak_child_rss_mb": get_peak_rss_mb(resource.RUSAGE_CHILDREN)}, peaks_file)
@@ -0,0 +1,148 @@
+""" Benchmarks extract_coderefs.py offline: generates a synthetic docset (or reuses one), runs the
+script against the local GitHub API stub, and prints throughput and peak memory as JSON so
+results can be compared across commits."""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate_docset import generate_docset, generate_sample_repos
+from github_stub import start_stub
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Not available on Windows
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extract_coderefs.py")
+MEASURE_RSS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "measure_rss.py")
+
+def run_benchmark(work_folder, args):
+    docset_folder = os.path.join(work_folder, "docset")
+
+    if os.path.exists(docset_folder):
+        with open(os.path.join(work_folder, "config.json")) as config_file:
+            config = json.load(config_file)
+    else:
+        entry = generate_docset(docset_folder, args.articles, args.refs, args.globs, args.commits,
+            args.repos, args.files, seed=args.seed)
+        config = {"content": [entry]}
+        generate_sample_repos(os.path.join(work_folder, "remotes"), args.repos, args.files, args.commits, args.seed)
+
+    # Cache settings apply per run: with --warm-cache, the cache from a previous run is reused.
+    config["commit_cache"] = {"path": os.path.join(work_folder, "commit_cache.db"), "ttl_hours": args.ttl_hours}
+    config["github"] = {"concurrency": args.concurrency, "backend": args.backend, "since_filter": args.since_filter,
+        "mirror_folder": os.path.join(work_folder, "mirrors"),
+        "mirror_remotes": {"https://github.com/": "file://" + os.path.join(work_folder, "remotes") + "/"}}
+
+    if args.snippet_check:
+        config["snippet_check"] = {"blob_cache": os.path.join(work_folder, "blob_cache.db"), "concurrency": args.concurrency}
+
+    with open(os.path.join(work_folder, "config.json"), "w") as config_file:
+        json.dump(config, config_file, indent=4)
+
+    if not args.warm_cache:
+        if os.path.exists(config["commit_cache"]["path"]):
+            os.remove(config["commit_cache"]["path"])
+
+        shutil.rmtree(config["github"]["mirror_folder"], ignore_errors=True)
+
+        if os.path.exists(os.path.join(work_folder, "blob_cache.db")):
+            os.remove(os.path.join(work_folder, "blob_cache.db"))
+
+    # The cache is keyed by URL, so a warm cache only helps if the stub keeps the same port.
+    stub = start_stub(args.port, args.latency, args.rate_limit, max_commits=args.max_commits)
+    results_folder = os.path.join(work_folder, "results")
+
+    env = dict(os.environ)
+    env["CODEREFS_REPO_ROOT"] = work_folder
+    env["CODEREFS_RESULTS_FOLDER"] = results_folder
+    env["GITHUB_API_URL"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    env.setdefault("GITHUB_USER", "bench")
+    env.setdefault("GITHUB_ACCESS_TOKEN", "bench")
+
+    command = [sys.executable, os.path.abspath(SCRIPT), "--config", os.path.join(work_folder, "config.json")]
+    command += args.script_args
+    peaks_file = os.path.join(work_folder, "peak_rss.json")
+
+    # Peak memory is measured in the script's own process, since this one's children include the
+    # git processes that generated the docset, and the largest of the script's children is only
+    # one of its --jobs workers.
+    if None != resource:
+        command[1:1] = [MEASURE_RSS, peaks_file]
+
+    start = time.perf_counter()
+    completed = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    elapsed = time.perf_counter() - start
+    stub.shutdown()
+
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stdout.decode("utf-8", "replace"))
+        sys.exit(completed.returncode)
+
+    # The newest CSV file holds this run's results.
+    result_files = sorted(glob.glob(os.path.join(results_folder, "*.csv")), key=os.path.getmtime)
+
+    with open(result_files[-1], newline="", encoding="utf-8") as csv_file:
+        refs = sum(1 for _ in csv.reader(csv_file)) - 1
+
+    articles = sum(1 for _, _, files in os.walk(docset_folder) for file in files if file.endswith(".md"))
+    peaks = {}
+
+    if None != resource:
+        with open(peaks_file) as peaks_json:
+            peaks = json.load(peaks_json)
+
+    return {
+        "seconds": round(elapsed, 3),
+        "articles": articles,
+        "refs": refs,
+        "files_per_second": round(articles / elapsed, 1),
+        "refs_per_second": round(refs / elapsed, 1),
+        "peak_rss_mb": peaks.get("peak_rss_mb"),
+        "peak_child_rss_mb": peaks.get("peak_child_rss_mb"),
+        "stub_requests": stub.state.requests,
+        "stub_not_modified": stub.state.not_modified,
+        "stub_rate_limited": stub.state.rejected,
+        "stub_blobs": stub.state.blobs_served,
+        "script_args": args.script_args
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+        epilog="Arguments after -- are passed to extract_coderefs.py, for example -- --jobs 4 --profile")
+    parser.add_argument("--work", help="Work folder; a docset generated in an earlier run is reused (default: a temporary folder)")
+    parser.add_argument("--articles", type=int, default=1000, help="Number of articles")
+    parser.add_argument("--refs", type=int, default=3, help=":::code references per article that has them")
+    parser.add_argument("--globs", type=int, default=50, help="Number of docfx fileMetadata globs")
+    parser.add_argument("--commits", type=int, default=200, help="Number of commits in the docset history")
+    parser.add_argument("--repos", type=int, default=5, help="Number of sample repositories")
+    parser.add_argument("--files", type=int, default=100, help="Number of referenced files per sample repository")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the docset")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the GitHub API stub")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stub delays each response")
+    parser.add_argument("--rate-limit", type=int, default=5000, help="Requests the stub allows per hour")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent GitHub requests")
+    parser.add_argument("--backend", default="rest", help="GitHub backend: rest, graphql, or mirror (cloned from sample repositories in the work folder)")
+    parser.add_argument("--since-filter", action="store_true", help="Request only the commits since each reference's start date")
+    parser.add_argument("--max-commits", type=int, default=40, help="Most commits the stub returns for a file")
+    parser.add_argument("--ttl-hours", type=float, default=24, help="Commit cache TTL")
+    parser.add_argument("--snippet-check", action="store_true", help="Check whether referenced snippets changed, with a blob cache in the work folder")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the commit cache, mirrors, and blob cache from the previous run in the work folder")
+    parser.add_argument("script_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.work:
+        os.makedirs(args.work, exist_ok=True)
+        print(json.dumps(run_benchmark(os.path.abspath(args.work), args), indent=4))
+    else:
+        with tempfile.TemporaryDirectory() as work_folder:
+            print(json.dumps(run_benchmark(work_folder, args), indent=4))
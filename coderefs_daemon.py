@@ -0,0 +1,269 @@
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlparse
+
+from utilities import *
+from extract_coderefs import DocsetCompleted, open_docset_processor
+from result_sinks import CodeRef, get_result_columns
+from profiling import profile
+
+class DocsetResults(NamedTuple):
+    """ The latest results of a docset, indexed for queries. head is the commit of the docset's
+    clone that they're for (None outside a clone) and scanned the time of the scan. articles
+    maps the path of each article in the clone to its CodeRefs, and stale maps each ms.service
+    to the CodeRefs of is_stale."""
+    head: str
+    scanned: float
+    ref_count: int
+    articles: dict
+    stale: dict
+    profile: dict
+
+
+def is_stale(ref):
+    """ Returns whether a CodeRef suggests that its article needs a look: the snippet it embeds
+    changed since ms.date, or, without a snippet check result, the file has commits since."""
+    if ref.snippet_changed in ("yes", "no"):
+        return "yes" == ref.snippet_changed
+
+    return (ref.commits_since_ms_date or 0) > 0
+
+
+def print_warnings(diagnostic):
+    if "INFO" != diagnostic.type:
+        print_reports([diagnostic])
+
+
+def index_results(folder, head, refs, summary):
+    """ Returns the DocsetResults for the CodeRefs of the docset in folder. Article paths are
+    relative to the top of the docset's clone, or to folder outside one."""
+    articles = {}
+    stale = {}
+    paths = {}
+
+    for ref in refs:
+        if not ref.file in paths:
+            paths[ref.file] = ((get_repo_path(folder, ref.file) if None != head else None)
+                or os.path.relpath(ref.file, folder).replace(os.sep, "/"))
+
+        articles.setdefault(paths[ref.file], []).append(ref)
+
+        if is_stale(ref):
+            stale.setdefault(ref.ms_service, []).append(ref)
+
+    return DocsetResults(head, time.time(), len(refs), articles, stale, summary)
+
+
+class CodeRefsDaemon:
+    """ Keeps the results of the docsets in config current: scans them all, then scans again
+    each docset whose clone's HEAD has moved, checking every poll_seconds, and every docset
+    every refresh_minutes, when commit histories are obtained again. Scans are incremental,
+    with each docset's parsed articles and compiled fileMetadata globs kept in memory, and
+    share the commit cache, GitHub client, and process pool throughout. Results are replaced
+    whole when a docset's scan completes, so queries from other threads needn't lock."""
+
+    def __init__(self, config, poll_seconds=10, refresh_minutes=60):
+        self.config = config
+        self.poll_seconds = poll_seconds
+        self.refresh_minutes = refresh_minutes
+        self.columns = [name for name, _ in get_result_columns(config)]
+        self.results = {}   # DocsetResults by docset
+        self.states = {}    # scan_state of iter_docset by docset
+        self.heads = {}     # HEAD commit of the last scan by docset, even if it failed
+        self.ready = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self, process, forget):
+        """ Keeps the results current until stop is called. process and forget are those of
+        open_docset_processor."""
+        refreshed = time.time()
+        self.update(process, True)
+        self.ready.set()
+
+        while not self.stopped.wait(self.poll_seconds):
+            refresh = time.time() - refreshed >= self.refresh_minutes * 60
+
+            if refresh:
+                forget()
+                refreshed = time.time()
+
+            self.update(process, refresh)
+
+    def stop(self):
+        self.stopped.set()
+
+    def update(self, process, refresh=False):
+        """ Scans the docsets whose HEAD has moved since their last scan, or all of them with
+        refresh."""
+        for content_set in self.config["content"]:
+            docset = content_set.get("repo")
+            folder = os.path.expandvars(content_set.get("path") or "")
+
+            if content_set.get("disabled") or self.stopped.is_set():
+                continue
+
+            head = get_head_commit(folder) if os.path.isdir(folder) else None
+
+            if not refresh and docset in self.heads and (None == head or head == self.heads[docset]):
+                continue
+
+            # Last commit dates of articles come from an index of the clone's history, which
+            # new commits make out of date.
+            if docset in self.heads and head != self.heads[docset]:
+                forget_local_commits(folder)
+
+            self.heads[docset] = head
+            self.scan(process, content_set, folder, head)
+
+    def scan(self, process, content_set, folder, head):
+        docset = content_set.get("repo")
+        refs = []
+        completed = None
+        start = time.perf_counter()
+        profile.reset()
+
+        # Every scan reports each article with references, so only warnings and errors are
+        # printed.
+        try:
+            with handle_reports(print_warnings):
+                for event in process(content_set, scan_state=self.states.setdefault(docset, {})):
+                    if isinstance(event, CodeRef):
+                        refs.append(event)
+                    elif isinstance(event, DocsetCompleted):
+                        completed = event
+        except Exception as e:
+            report("ERROR", "Could not scan docset", str(e).replace(",", ";"), docset)
+            return
+
+        if None == completed:
+            return
+
+        self.results = dict(self.results, **{docset: index_results(folder, head, refs, completed.profile)})
+        report("INFO", "Updated docset results", f"{len(refs)} references in {time.perf_counter() - start:.2f} seconds", docset)
+
+    def get_article_refs(self, article):
+        """ Returns the CodeRefs of an article, given by its path in its clone (or in its docset
+        folder outside a clone), with / separators."""
+        return [ref for results in self.results.values() for ref in results.articles.get(article, [])]
+
+    def get_stale_refs(self, service, subservice=None):
+        """ Returns the CodeRefs of is_stale for an ms.service, and ms.subservice if given."""
+        return [ref for results in self.results.values() for ref in results.stale.get(service, [])
+            if None == subservice or subservice == ref.ms_subservice]
+
+    def get_status(self):
+        return {"ready": self.ready.is_set(), "docsets": {docset: {"head": results.head, "scanned": results.scanned,
+            "refs": results.ref_count, "profile": results.profile} for docset, results in self.results.items()}}
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    """ Answers GET requests for the results of the server's CodeRefsDaemon with JSON:
+    /refs?article=<path>, /stale?service=<ms.service>[&subservice=<ms.subservice>], and
+    /status. References are objects with a property for each column of the results."""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        coderefs = self.server.coderefs
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path == "/status":
+            self.send_json(200, coderefs.get_status())
+            return
+
+        if not url.path in ("/refs", "/stale"):
+            self.send_json(404, {"message": "Not Found"})
+            return
+
+        if not coderefs.ready.is_set():
+            self.send_json(503, {"message": "The first scan is in progress"})
+            return
+
+        if url.path == "/refs":
+            if not "article" in query:
+                self.send_json(400, {"message": "Missing article parameter"})
+                return
+
+            refs = coderefs.get_article_refs(query["article"])
+        else:
+            if not "service" in query:
+                self.send_json(400, {"message": "Missing service parameter"})
+                return
+
+            refs = coderefs.get_stale_refs(query["service"], query.get("subservice"))
+
+        self.send_json(200, {"refs": [dict(zip(coderefs.columns, ref)) for ref in refs]})
+
+
+def serve_coderefs(config, options=None):
+    """ Runs a CodeRefsDaemon for config, with options as for iter_coderefs, and serves its
+    results over HTTP as the "daemon" section of config.json says, until interrupted."""
+    daemon_config = config.get("daemon", {})
+    coderefs = CodeRefsDaemon(config, daemon_config.get("poll_seconds", 10), daemon_config.get("refresh_minutes", 60))
+
+    with open_docset_processor(config, options) as (process, forget):
+        # The server is started after the process pool, so that its workers don't inherit the
+        # listening socket. It binds to the local host unless configured otherwise.
+        server = ThreadingHTTPServer((daemon_config.get("host", "127.0.0.1"), daemon_config.get("port", 8780)), DaemonHandler)
+        server.daemon_threads = True
+        server.coderefs = coderefs
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        host, port = server.server_address[:2]
+        report("INFO", "Serving code references", f"http://{host}:{port}", "")
+
+        try:
+            coderefs.run(process, forget)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            coderefs.stop()
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    config_file, _, options = parse_config_arguments(sys.argv[1:])
+
+    if config_file is None:
+        print("Usage: python coderefs_daemon.py --config <config_file> [--jobs <processes>] [--profile]")
+        sys.exit(2)
+
+    config = None
+    with open(config_file, 'r') as config_load:
+        config = json.load(config_load)
+
+    if config is None:
+        print("coderefs_daemon: Could not deserialize config file")
+        sys.exit(1)
+
+    if os.getenv("CODEREFS_REPO_ROOT") is None:
+        print("coderefs_daemon: Set environment variable CODEREFS_REPO_ROOT to your repo root before running the script.")
+        sys.exit(1)
+
+    # Caches with relative paths are in the results folder, as for extract_coderefs.py.
+    results_folder = os.getenv("CODEREFS_RESULTS_FOLDER", "data")
+
+    if not os.path.exists(results_folder):
+        os.makedirs(results_folder)
+
+    os.chdir(results_folder)
+
+    print("Script,Type,Message,Detail,Item")
+    serve_coderefs(config, options)
@@ -0,0 +1,132 @@
+import json
+import sqlite3
+import threading
+import time
+from profiling import profile
+from utilities import report
+
+class CommitCache:
+    """ Persistent cache of GitHub commit history responses, keyed by the history URL. Along with
+    the response data, each entry keeps the ETag and Last-Modified headers so that stale entries
+    can be revalidated with a conditional request; GitHub doesn't count 304 responses against
+    the rate limit."""
+
+    def __init__(self, path=":memory:", ttl_hours=24, expire_days=30, max_entries=50000):
+        # Entries validated within ttl_hours are used without a request; older entries are
+        # revalidated. Entries not used in expire_days are evicted, as are the least recently
+        # used entries beyond max_entries.
+        self.path = path
+        self.ttl = ttl_hours * 3600
+        self.expire = expire_days * 86400
+        self.max_entries = max_entries
+
+        # URLs of the entries stored or validated during this run, which are fresh until it ends.
+        # Their data isn't kept in memory: the clients keep a CommitSummary of each file's
+        # history instead, and seldom look up the same URL twice.
+        self.fresh = set()
+        self.lock = threading.Lock()
+
+        # Times that entries were used, by URL, written together by write_accessed so that
+        # lookups don't hold the database's write lock.
+        self.accessed = {}
+
+        # Other runs, such as a daemon's, can share the database: write-ahead logging lets them
+        # read while one writes, and the timeout lets writers take turns. Should the database
+        # still be unavailable, lookups miss and writes are skipped.
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS commit_history (
+            url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,
+            validated REAL NOT NULL, accessed REAL NOT NULL, data TEXT NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS commit_history_accessed ON commit_history (accessed)")
+        self.db.commit()
+
+    def get(self, url):
+        """ Returns a dictionary with the cached data, etag, last_modified, and whether the entry
+        is still fresh, or None if the URL isn't cached."""
+        with self.lock:
+            try:
+                row = self.db.execute("SELECT etag, last_modified, validated, data FROM commit_history WHERE url = ?",
+                    (url,)).fetchone()
+            except sqlite3.Error as e:
+                report("WARNING", "Could not read commit cache", str(e).replace(",", ";"), url)
+                row = None
+
+            if None == row:
+                profile.count("cache_misses")
+                return None
+
+            now = time.time()
+            self.accessed[url] = now
+
+            entry = {"data": json.loads(row[3]), "etag": row[0], "last_modified": row[1],
+                "fresh": url in self.fresh or now - row[2] < self.ttl}
+
+            # Fresh entries stay fresh for the rest of the run; stale ones once revalidated.
+            if entry["fresh"]:
+                profile.count("cache_hits")
+                self.fresh.add(url)
+            else:
+                profile.count("cache_stale")
+
+            return entry
+
+    def put(self, url, data, etag=None, last_modified=None):
+        now = time.time()
+
+        with self.lock:
+            if self.write("INSERT OR REPLACE INTO commit_history VALUES (?, ?, ?, ?, ?, ?)",
+                    [(url, etag, last_modified, now, now, json.dumps(data, separators=(",", ":")))], url):
+                self.fresh.add(url)
+
+    def revalidated(self, url):
+        """ Marks a cached entry as fresh following a 304 Not Modified response."""
+        now = time.time()
+
+        with self.lock:
+            if self.write("UPDATE commit_history SET validated = ?, accessed = ? WHERE url = ?", [(now, now, url)], url):
+                self.fresh.add(url)
+
+    def write(self, statement, rows, item=""):
+        # Called with self.lock held. Runs statement for each of rows in a transaction of its
+        # own, and returns whether it succeeded.
+        try:
+            self.db.executemany(statement, rows)
+            self.db.commit()
+            return True
+        except sqlite3.Error as e:
+            self.db.rollback()
+            report("WARNING", "Could not write commit cache", str(e).replace(",", ";"), item)
+            return False
+
+    def write_accessed(self):
+        # Called with self.lock held
+        self.write("UPDATE commit_history SET accessed = ? WHERE url = ?",
+            [(accessed, url) for url, accessed in self.accessed.items()], self.path)
+        self.accessed = {}
+
+    def forget(self):
+        """ Starts a new run, as the daemon does for each refresh: entries are fresh again only
+        within their TTL. The times entries were used so far are written."""
+        with self.lock:
+            self.fresh = set()
+            self.write_accessed()
+
+    def close(self):
+        """ Evicts expired and excess entries, then closes the database."""
+        with self.lock:
+            self.write_accessed()
+            self.write("DELETE FROM commit_history WHERE accessed < ?", [(time.time() - self.expire,)], self.path)
+            self.write("""DELETE FROM commit_history WHERE url NOT IN
+                (SELECT url FROM commit_history ORDER BY accessed DESC LIMIT ?)""", [(self.max_entries,)], self.path)
+            self.db.close()
+
+
+def open_commit_cache(cache_config):
+    """ Opens the commit cache described by the "commit_cache" section of config.json. Without
+    that section, the cache lives in memory for the current run only."""
+    if None == cache_config:
+        return CommitCache()
+
+    return CommitCache(cache_config.get("path", "commit_cache.db"), cache_config.get("ttl_hours", 24),
+        cache_config.get("expire_days", 30), cache_config.get("max_entries", 50000))
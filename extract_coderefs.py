@@ -1,165 +1,526 @@
-import csv
+import collections
+import contextlib
+import functools
 import os
+import queue
 import sys
-import pathlib
+import threading
 import json
+from typing import NamedTuple
 
 
 from utilities import *
-
-def extract_coderefs(config, results_folder):
+from commit_cache import open_commit_cache
+from github_client import open_github_client
+from result_sinks import CodeRef, get_result_columns, open_result_sink
+from snippets import open_snippet_checker
+from profiling import profile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+class DocsetStarted(NamedTuple):
+    """ Yielded by iter_coderefs before the CodeRefs of a docset. name is the last part of the
+    docset's repo, which starts the names of its result files."""
+    docset: str
+    name: str
+
+
+class DocsetCompleted(NamedTuple):
+    """ Yielded by iter_coderefs after the CodeRefs of a docset, with the docset's profile
+    summary if profiling is on, otherwise None."""
+    docset: str
+    profile: dict
+
+
+def extract_coderefs(config, results_folder, options=None):
+    """ Writes the code references of the docsets in config to a results file for each docset,
+    printing diagnostics as CSV lines."""
     # Header for error output CSV
     print("Script,Type,Message,Detail,Item")
 
-    for content_set in config["content"]:
-        results = []
-
-        # Load up docset configuration
-        # TODO: can do more error checking and validation here
-        docset = content_set.get("repo")
-        folder = os.path.expandvars(content_set.get("path"))  # Expands ${CODEREFS_REPO_ROOT}
-        opc_path = os.path.join(folder, content_set.get("opc_folder"), ".openpublishing.publish.config.json")
-        docfx_folder = os.path.join(folder, content_set.get("docfx_folder"))
-        docfx_path = os.path.join(docfx_folder, "docfx.json")
-        disabled = content_set.get("disabled")
-        base_url = content_set.get("url")
-        exclude_folders = content_set.get("exclude_folders")
-
-        # Determine whether we can or need to process this docset
-        if docset is None or base_url is None:
-            print(f"extract_coderefs, ERROR, Malformed config entry for docset, Check your config file, {docset}")
-            continue
+    # Sinks of the docsets in progress, by docset
+    sinks = {}
+    complete = False
+
+    try:
+        for event in iter_coderefs(config, options):
+            if isinstance(event, CodeRef):
+                with profile.stage("write_csv"):
+                    sinks[event.docset].writerows([event])
+            elif isinstance(event, Diagnostic):
+                print_reports([event])
+            elif isinstance(event, DocsetStarted):
+                # Results are written to the CSV file (or other sink selected by the output
+                # section of config.json) as they arrive, so an interrupted run keeps what it
+                # has written.
+                sinks[event.docset] = open_result_sink(config.get("output"), event.name, event.docset, get_result_columns(config))
+                report("INFO", "Writing results", "", sinks[event.docset].name)
+            elif isinstance(event, DocsetCompleted):
+                sink = sinks.pop(event.docset)
+                sink.close()
+                report("INFO", "Completed results", "", sink.name)
+
+                if None != event.profile:
+                    write_profile_summary(event.profile, sink.filename)
+
+        complete = True
+    finally:
+        for sink in sinks.values():
+            sink.close(complete)
+
+
+def write_profile_summary(summary, result_filename):
+    """ Reports the stage timings of a docset's profile summary and saves the summary next to
+    its results file."""
+    for stage, seconds in summary["stages"].items():
+        report("INFO", "Profile stage seconds", f"{stage} {seconds}", summary["docset"])
+
+    with open(result_filename + '.profile.json', 'w', encoding='utf-8') as profile_file:
+        json.dump(summary, profile_file, indent=4)
+
+    report("INFO", "Wrote profile summary", "", f"{result_filename}.profile.json")
+
+
+def iter_coderefs(config, options=None):
+    """ Extracts the code references of the docsets in config, the contents of config.json, and
+    yields a CodeRef for each as its commit history arrives. A docset's CodeRefs come in order of
+    article path and line, between a DocsetStarted and a DocsetCompleted, and the diagnostics
+    that the script prints are yielded as Diagnostics. options are those of
+    parse_config_arguments, plus state_folder, where --incremental keeps its state (default:
+    the current folder). Closing the generator early stops the work. Diagnostics and the profile
+    are process-wide, so only one iter_coderefs can run in a process at a time."""
+    options = options or {}
+
+    # With --docsets, that many docsets are processed at once, sharing the commit cache, the
+    # GitHub client with its connections and rate limit budget, and the process pool. The
+    # profile then covers all the docsets, because the work done for them overlaps.
+    concurrent_docsets = options.get("docsets", 1)
+
+    # Diagnostics reported by any thread are queued while the generator runs and yielded
+    # ahead of the next event, except those that the consumer's thread reports while it has an
+    # event, which are its own.
+    diagnostics = collections.deque()
+    consumer = None
+
+    def queue_diagnostic(diagnostic):
+        if threading.get_ident() == consumer:
+            emit_reports([diagnostic], below=queue_diagnostic)
+        else:
+            diagnostics.append(diagnostic)
+
+    def iter_events(events):
+        with contextlib.closing(events):
+            for event in events:
+                while len(diagnostics) > 0:
+                    yield diagnostics.popleft()
+
+                yield event
+
+        while len(diagnostics) > 0:
+            yield diagnostics.popleft()
+
+    with open_docset_processor(config, options) as (process, _):
+        with handle_reports(queue_diagnostic):
+            if concurrent_docsets > 1:
+                profile.reset()
+                events = iter_concurrently([process(content_set) for content_set in config["content"]], concurrent_docsets)
+            else:
+                events = iter_serially(process, config["content"])
+
+            with contextlib.closing(iter_events(events)) as items:
+                for item in items:
+                    consumer = threading.get_ident()
+                    yield item
+                    consumer = None
+
+
+@contextlib.contextmanager
+def open_docset_processor(config, options=None):
+    """ Sets up the process pool, commit cache, GitHub client, and snippet checker for processing
+    the docsets in config with options, as for iter_coderefs, and closes them at the end of the
+    with block. Yields two functions: process(content_set, **kwargs) returns the event
+    generator of iter_docset for a docset, and forget() drops the commit histories and snippet
+    checks obtained so far, so that docsets processed later get them anew."""
+    # With --jobs, articles are read and parsed on a pool of processes. Its workers are started
+    # before any other threads, so that none of them inherits a file descriptor that a thread
+    # has open at the time, such as the pipe of a git process being started.
+    options = options or {}
+    jobs = options.get("jobs", 1)
+    process_pool = ProcessPoolExecutor(jobs) if jobs > 1 else None
+
+    if None != process_pool:
+        process_pool.submit(int).result()
+
+    # Cache commit history obtained from GitHub to avoid redundant API calls, thereby improving
+    # performance and lowering API usage. The cache is shared by all docsets and, when config.json
+    # has a commit_cache section, persists across runs.
+    commit_cache = open_commit_cache(config.get("commit_cache"))
+
+    # Commit histories are fetched on a pool of threads, sharing one connection pool and rate
+    # limit budget, while the scan continues.
+    github_config = config.get("github", {})
+    github_client = open_github_client(commit_cache, github_config)
+
+    # With a snippet_check section in config.json, each reference also gets whether the part of
+    # the file that it embeds has changed since the article's ms.date.
+    snippet_checker = open_snippet_checker(github_client, config.get("snippet_check"))
+
+    # The number of articles the scan can get ahead of the commit histories needed to yield
+    # their results.
+    max_pending = github_config.get("max_pending_articles", 1000)
+
+    # With --incremental, only articles changed since the last run are parsed again.
+    incremental = options.get("incremental", False)
+
+    # With --profile, stage timings and counters are summarized for each docset.
+    profiling = options.get("profile", False)
+
+    process = functools.partial(iter_docset, github_client=github_client, process_pool=process_pool,
+        jobs=jobs, max_pending=max_pending, incremental=incremental, profiling=profiling,
+        state_folder=options.get("state_folder", ""), snippet_checker=snippet_checker)
+
+    def forget():
+        github_client.forget()
+
+        if None != snippet_checker:
+            snippet_checker.forget()
+
+    try:
+        yield process, forget
+    finally:
+        if None != process_pool:
+            process_pool.shutdown(cancel_futures=True)
+
+        if None != snippet_checker:
+            snippet_checker.close()
+
+        github_client.close()
+        commit_cache.close()
+
+
+def iter_serially(process, content_sets):
+    """ Yields the events of each docset in turn, profiling each on its own."""
+    for content_set in content_sets:
+        profile.reset()
+        yield from process(content_set)
+
+
+def iter_concurrently(generators, workers, max_queued=1000):
+    """ Runs up to workers of the given generators at once on threads and yields their items as
+    they come. The bounded queue keeps the threads from getting far ahead of the consumer."""
+    items = queue.Queue(max_queued)
+    stopped = threading.Event()
+
+    def run(generator):
+        with contextlib.closing(generator):
+            for item in generator:
+                while not stopped.is_set():
+                    try:
+                        items.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+
+                if stopped.is_set():
+                    return
+
+    with ThreadPoolExecutor(workers, thread_name_prefix="docset") as executor:
+        futures = [executor.submit(run, generator) for generator in generators]
+
+        try:
+            while True:
+                try:
+                    yield items.get(timeout=0.1)
+                except queue.Empty:
+                    if all(future.done() for future in futures) and items.empty():
+                        break
+
+            # Raise the exception of any docset that failed.
+            for future in futures:
+                future.result()
+        finally:
+            stopped.set()
+
+
+def iter_docset(content_set, github_client, process_pool, jobs, max_pending, incremental, profiling, state_folder="",
+        snippet_checker=None, scan_state=None):
+    """ Scans the docset described by content_set, an entry in the "content" list of config.json,
+    and yields its events for iter_coderefs. scan_state is a dictionary that a caller scanning
+    the docset repeatedly, such as the daemon, keeps for it: the scan is then incremental, with
+    the state kept there rather than in a file, along with the compiled fileMetadata globs."""
+    # Load up docset configuration
+    # TODO: can do more error checking and validation here
+    docset = content_set.get("repo")
+    folder = os.path.expandvars(content_set.get("path"))  # Expands ${CODEREFS_REPO_ROOT}
+    opc_path = os.path.join(folder, content_set.get("opc_folder"), ".openpublishing.publish.config.json")
+    docfx_folder = os.path.join(folder, content_set.get("docfx_folder"))
+    docfx_path = os.path.join(docfx_folder, "docfx.json")
+    disabled = content_set.get("disabled")
+    base_url = content_set.get("url")
+    exclude_folders = content_set.get("exclude_folders")
+
+    # Determine whether we can or need to process this docset
+    if docset is None or base_url is None:
+        report("ERROR", "Malformed config entry for docset", "Check your config file", docset)
+        return
+
+    if disabled:
+        report("INFO", "Docset disabled", "Skipping", docset)
+        return
+
+    if folder is None:
+        report("WARNING", "No path for docset", "Skipping", docset)
+        return
+
+    # Look for the .openpublishing.publish.config.json file, which contains the external repo references
+    repo_data = None
+
+    with open(opc_path) as opc:
+        data = json.load(opc)
+        repo_data = data["dependent_repositories"]
+
+    if repo_data == None:
+        report("WARNING", "Docset lacks .openpublishing.publish.config.json file", "Skipping", docset)
+        return
+
+    github_client.add_repositories(repo_data)
+
+    # We need fileMetadata from docfx.json to obtain metadata for individual files; the absence,
+    # however, is not blocking.
+    file_metadata = None        
+
+    with open(docfx_path) as dfx:
+        data = json.load(dfx)
+        file_metadata = data["build"]["fileMetadata"]
+        build_content = data["build"].get("content")
+
+    if file_metadata == None:
+        report("INFO", "Docset lacks docfx.json metadata info", "", docset)
+
+
+    # We can proceed with this docset
+    report("INFO", "Processing docset", docset, folder)
+    
+    # Compile the fileMetadata globs once so that each article is matched against them
+    # without touching the filesystem.
+    desired_metadata = ["ms.author", "ms.reviewer", "ms.service", "ms.subservice"]
+
+    globs_key = (docfx_folder, file_metadata)
+
+    if None != scan_state and globs_key == scan_state.get("globs_key"):
+        globs = scan_state["globs"]
+    else:
+        with profile.stage("compile_globs"):
+            globs = get_file_metadata_globs(docfx_folder, file_metadata, desired_metadata)
+
+        if None != scan_state:
+            scan_state.update(globs_key=globs_key, globs=globs)
+
+    # Collect the paths of all the articles to parse, from the git index if the docset is in a
+    # clone. With docfx_content_only, articles that aren't part of the docfx build are omitted.
+    # Results are written in order of article path, then line, which is the order in which we
+    # scan the articles as their paths are sorted.
+    content_globs = get_content_globs(build_content) if content_set.get("docfx_content_only") else None
+
+    with profile.stage("enumerate_articles"):
+        article_paths = enumerate_articles(folder, exclude_folders, docfx_folder, content_globs)
+
+    profile.count("articles_enumerated", len(article_paths))
+
+    # In incremental mode, articles that haven't changed since the last successful run are
+    # taken from the state it saved rather than parsed again, unless the docset's
+    # configuration, docfx.json, or .openpublishing.publish.config.json has changed.
+    name = docset.rsplit("/", 1)[-1]
+    state_path = os.path.join(state_folder, name + "_state.json")
+    head_commit = get_head_commit(folder) if incremental or None != scan_state else None
+    reused_articles = {}
+    changed_commits = {}
+
+    if None != head_commit:
+        if None == scan_state:
+            state = load_scan_state(state_path)
+        else:
+            state = scan_state if "head" in scan_state else None
+
+        changed_files = None
+
+        if None != state and state.get("config") == content_set:
+            changed_files = get_changed_files(folder, state["head"])
+
+        # Changed files are named by their paths in the clone. Should any file's path in the
+        # clone be unknown, which of them changed can't be told, so all articles are scanned.
+        config_files = [get_repo_path(folder, path) for path in (opc_path, docfx_path)]
+        repo_paths = {}
+
+        if None != changed_files:
+            repo_paths = {full_path: get_repo_path(folder, full_path) for full_path in article_paths}
+
+        if (None == changed_files or None in config_files or None in repo_paths.values()
+                or any(path in changed_files for path in config_files)):
+            report("INFO", "Scanning all articles", "No usable state from a previous run", docset)
+        else:
+            report("INFO", "Scanning articles changed since last run", state["head"], docset)
+
+            # Saved articles are keyed by their paths in the clone, so the state still applies
+            # if the clone has moved. Articles missing from it are parsed.
+            for full_path in article_paths:
+                repo_path = repo_paths[full_path]
+
+                if not repo_path in changed_files and repo_path in state["articles"]:
+                    article_state = state["articles"][repo_path]
+
+                    # State kept in memory holds the records themselves.
+                    reused_articles[full_path] = load_article_state(article_state) if None == scan_state else article_state
+
+            # Changed articles get their last commit dates from the commits since the last run.
+            with profile.stage("local_history"):
+                changed_commits = build_local_commit_index(get_repo_toplevel(folder), state["head"])
+
+        # Only the reused articles, now as records, are needed from the saved state.
+        state = None
+        repo_paths = None
+
+    # Parse the articles, across the process pool if there is one. map returns the results
+    # in the order of article_paths either way, so the output doesn't depend on --jobs.
+    parse = functools.partial(parse_article, docfx_folder=docfx_folder, globs=globs,
+        desired_fields=desired_metadata, repo_data=repo_data)
+    parse_paths = [path for path in article_paths if not path in reused_articles]
+    profile.count("articles_parsed", len(parse_paths))
+
+    if None == process_pool:
+        parsed_articles = map(parse, parse_paths)
+    else:
+        chunksize = max(1, min(64, len(parse_paths) // (jobs * 4)))
+        parsed_articles = process_pool.map(parse, parse_paths, chunksize=chunksize)
+
+    # Results are yielded as each article's commit histories arrive, so they needn't all be
+    # held in memory.
+    yield DocsetStarted(docset, name)
+
+    # Articles stored for the next incremental run, if this is one
+    state_articles = {}
+
+    # Articles with external code references whose results are yet to be yielded: tuples of
+    # the article's path, metadata, last local commit date, and code references.
+    pending = collections.deque()
+
+    for full_path, metadata, coderefs, reports, last_local_commit in merge_articles(article_paths, parsed_articles, reused_articles):
+        emit_reports(reports)
+
+        # Articles without references are stored too, as None, so that an article missing from
+        # the state is known to need parsing.
+        repo_path = get_repo_path(folder, full_path) if None != head_commit else None
+
+        if None == coderefs or len(coderefs) == 0:
+            if None != repo_path:
+                state_articles[repo_path] = None
 
-        if disabled:
-            print(f"extract_coderefs, INFO, Docset disabled, Skipping, {docset}")
             continue
 
-        if folder is None:
-            print(f"extract_coderefs, WARNING, No path for docset, Skipping, {docset}")
-            continue
+        report("INFO", "Processing external code references", "", full_path)
 
-        # Look for the .openpublishing.publish.config.json file, which contains the external repo references
-        repo_data = None
+        if None == last_local_commit:
+            last_local_commit = changed_commits.get(repo_path) or get_last_local_commit(folder, full_path)
 
-        with open(opc_path) as opc:
-            data = json.load(opc)
-            repo_data = data["dependent_repositories"]
+        # Commits before both ms.date and the last local commit don't affect the counts.
+        since = get_history_since(metadata.date, last_local_commit)
+        valid_refs = []
 
-        if repo_data == None:
-            print(f'extract_coderefs, WARNING, Docset lacks .openpublishing.publish.config.json file, Skipping, {docset}')
-            continue
+        for ref in coderefs:                
+            if None == ref.file_url:
+                report("WARNING", "Code reference uses invalid repo path_to_root", ref.line, full_path)
+                continue
 
-        # We need fileMetadata from docfx.json to obtain metadata for individual files; the absence,
-        # however, is not blocking.
-        file_metadata = None        
+            # Start fetching the commit history now so the network requests overlap the scan.
+            file_key = get_file_key(ref.file_url)
 
-        with open(docfx_path) as dfx:
-            data = json.load(dfx)
-            file_metadata = data["build"]["fileMetadata"]
+            if None != file_key:
+                github_client.submit(file_key, since)
 
-        if file_metadata == None:
-            print(f'extract_coderefs, INFO, Docset lacks docfx.json metadata info, , {docset}')
+                if None != snippet_checker:
+                    snippet_checker.submit(ref, metadata.date)
 
+            valid_refs.append(ref)
 
-        # We can proceed with this docset
-        print(f'extract_coderefs, INFO, Processing docset, {docset}, {folder}')
-        
-        # Cache the file lists for globs; globbing is a slow operation that we don't want
-        # to do with every file!
-        desired_metadata = ["ms.author", "ms.reviewer", "ms.service", "ms.subservice"]
-        globs = get_file_metadata_globs(docfx_folder, file_metadata, desired_metadata)
+        profile.count("refs_found", len(valid_refs))
 
-        # Cache commit history obtained from GitHub to avoid redundant API calls
-        # thereby improving performance and lowering API usage.
-        commit_cache = { }
+        pending.append((full_path, metadata, last_local_commit, valid_refs))
 
-        for root, dirs, files in os.walk(folder):
-            # Omit any excluded folders from those we'll process.
-            # TODO: does this have any effect?
-            for exclusion in exclude_folders:
-                if exclusion in dirs:
-                    dirs.remove(exclusion)
+        if None != repo_path:
+            state_articles[repo_path] = (metadata, valid_refs, last_local_commit)
 
-            for file in files:
-                if pathlib.Path(file).suffix != '.md':
-                    continue
+        # Yield the results of articles whose commit histories have all arrived, in order. Past
+        # max_pending articles, wait for the histories instead of scanning further ahead.
+        while len(pending) > 0 and (len(pending) > max_pending or article_ready(pending[0], github_client, snippet_checker)):
+            yield from get_article_rows(docset, folder, base_url, pending.popleft(), github_client, snippet_checker)
 
-                full_path = os.path.join(root, file)
+    while len(pending) > 0:
+        yield from get_article_rows(docset, folder, base_url, pending.popleft(), github_client, snippet_checker)
 
-                try:
-                    content = pathlib.Path(full_path).read_text(errors="replace")
-                except UnicodeDecodeError:
-                    print(f"extract_coderefs, WARNING, Skipping file that contains non-UTF-8 characters and should be converted, , {full_path}")
-                    continue
-
-                # TODO: add --verbose flag (with levels, perhaps) to include this message
-                # print(f"extract_coderefs, INFO, Processing file, , {full_path}")
-
-                metadata = extract_metadata_fields(content, docfx_folder, full_path, globs, desired_metadata)
+    if None != head_commit:
+        if None != scan_state:
+            scan_state.update(head=head_commit, config=content_set, articles=state_articles)
+        else:
+            save_scan_state(state_path, head_commit, content_set, state_articles)
 
-                # Content check: if metadata is empty, then the article lacks metadata, but this 
-                # isn't a blocking problem.                
-                if None == metadata or len(metadata) == 0:
-                    print(f"extract_coderefs, WARNING, File contains no metadata, , {full_path}")
+    summary = None
 
-                coderefs = find_external_code_refs(content, repo_data)
+    if profiling:
+        summary = profile.summary()
+        summary["docset"] = docset
 
-                if None == coderefs or len(coderefs) == 0:
-                    continue
+    yield DocsetCompleted(docset, summary)
 
-                print(f"extract_coderefs, INFO, Processing external code references, , {full_path}")
 
-                for ref in coderefs:                
-                    if not "file_url" in ref.keys():
-                        print(f"extract_coderefs, WARNING, Code reference uses invalid repo path_to_root, {ref['line']}, {full_path}")
+def article_ready(article, github_client, snippet_checker=None):
+    """ Returns whether the commit histories of all of an article's code references have been
+    fetched, and their snippets checked if that's enabled, so that its rows can be written
+    without waiting."""
+    for ref in article[3]:
+        file_key = get_file_key(ref.file_url)
 
-                    article_url = base_url + full_path[full_path.find('\\', len(folder) + 1) : -3].replace('\\','/')
-                
-                    last_local_commit = get_last_local_commit(folder, full_path)
-                    commit_data = get_commit_history(ref["file_url"], commit_cache, metadata["ms.date"], last_local_commit)
-                                        
-                    if None == commit_data:
-                        print(f"extract_coderefs, WARNING, No commit history obtained, {ref['file_url']}, {full_path}")
-                        continue
+        if None != file_key and not github_client.ready(file_key):
+            return False
 
-                    # NOTE: match the order of this list with the CSV header later
-                    results.append([
-                        docset, full_path, article_url, metadata["ms.service"], metadata["ms.subservice"],
-                        metadata["ms.author"], metadata["ms.reviewer"], metadata["ms.date"], last_local_commit,
-                        ref["line"], ref["type"], ref["detail"], ref["repo"], ref["file_url"],
-                        commit_data["commits_since_start"], commit_data["commits_since_local"],
-                        commit_data["most_recent"], commit_data["most_recent_url"]
-                    ])
+        if None != snippet_checker and not snippet_checker.ready(ref, article[1].date):
+            return False
 
+    return True
 
-        # Sort the results (by filename (index 1), then line number (index 9)), and save to a .csv file.
-        print("extract_coderefs, INFO, Sorting results by filename, , ")
-        results.sort(key=lambda row: (row[1], int(row[9])))        
 
-        # Open CSV output file, which we do before running the searches because
-        # we consolidate everything into a single file
+def get_article_rows(docset, folder, base_url, article, github_client, snippet_checker=None):
+    """ Returns the CodeRefs for an article's code references, waiting for their commit histories
+    (and snippet checks) if necessary. article is a tuple of the article's path, metadata, last
+    local commit date, and code references."""
+    full_path, metadata, last_local_commit, coderefs = article
+    article_url = base_url + full_path[full_path.find('\\', len(folder) + 1) : -3].replace('\\','/')
+    rows = []
 
-        result_filename = get_next_filename(docset.rsplit("/", 1)[-1])
-        print(f'extract_coderefs, INFO, Writing CSV results file, , {result_filename}.csv')
-
-        with open(result_filename + '.csv', 'w', newline='', encoding='utf-8') as csv_file:    
-            writer = csv.writer(csv_file)
+    for ref in coderefs:
+        commit_data = get_commit_history(ref.file_url, github_client, metadata.date, last_local_commit)
+                            
+        if None == commit_data:
+            report("WARNING", "No commit history obtained", ref.file_url, full_path)
+            continue
 
-            # NOTE: match the order of this header with the results.append call earlier
-            writer.writerow(["docset", "file", "articleUrl", "ms.service", "ms.subservice", "ms.author", "ms.reviewer",
-                "ms.date", "lastArticleCommit", "refLine", "refType", "refDetail", "repoUrl", "refUrl",
-                "commitsSinceMsDate", "commitsSinceLastLocalCommit", "mostRecentCommit", "mostRecentCommitUrl"])
-            writer.writerows(results)
+        rows.append(CodeRef(
+            docset, full_path, article_url, metadata.service, metadata.subservice,
+            metadata.author, metadata.reviewer, metadata.date, last_local_commit,
+            ref.line, ref.type, ref.detail, ref.repo, ref.file_url,
+            commit_data["commits_since_start"], commit_data["commits_since_local"],
+            commit_data["most_recent"], commit_data["most_recent_url"],
+            snippet_checker.get(ref, metadata.date) if None != snippet_checker else None
+        ))
 
-        print(f"extract_coderefs, INFO, Completed CSV results file, , {result_filename}.csv")
+    profile.count("rows_written", len(rows))
+    return rows
 
 
 if __name__ == "__main__":
     # Get input file arguments, defaulting to folders.txt and terms.txt
-    config_file, _ = parse_config_arguments(sys.argv[1:])
+    config_file, _, options = parse_config_arguments(sys.argv[1:])
 
     if config_file is None:
-        print("Usage: python extract_coderefs.py --config <config_file>")
+        print("Usage: python extract_coderefs.py --config <config_file> [--jobs <processes>] [--docsets <count>] [--incremental] [--profile]")
         sys.exit(2)
 
     config = None
@@ -184,4 +545,4 @@ if __name__ == "__main__":
 
     os.chdir(results_folder)
 
-    extract_coderefs(config, results_folder)
+    extract_coderefs(config, results_folder, options)
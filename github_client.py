@@ -0,0 +1,732 @@
+import base64
+import datetime
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+from urllib.parse import urlparse
+
+from profiling import profile
+from utilities import API_URL, get_history_url, report, summarize_commit_history
+
+# GITHUB_GRAPHQL_URL is needed for GitHub Enterprise, whose GraphQL endpoint isn't under API_URL.
+GRAPHQL_URL = os.getenv("GITHUB_GRAPHQL_URL", API_URL + "/graphql")
+
+class RateLimiter:
+    """ Tracks the rate limit budget reported by GitHub and holds back requests when the budget
+    is spent or GitHub has asked us to back off. Shared by all threads of a GitHubClient."""
+
+    def __init__(self, secondary_backoff=60):
+        self.lock = threading.Lock()
+        self.remaining = None       # Requests left in the current window, once known
+        self.reset = 0              # Epoch time at which the window resets
+        self.paused_until = 0       # Epoch time before which no request should be made
+        self.secondary_backoff = secondary_backoff
+        self.secondary_count = 0
+
+    def acquire(self):
+        """ Blocks until a request can be made, then reserves one request from the budget."""
+        while True:
+            with self.lock:
+                now = time.time()
+                wait = self.paused_until - now
+
+                if wait <= 0 and None != self.remaining and self.remaining <= 0 and now < self.reset:
+                    wait = self.reset - now + 1
+
+                if wait <= 0:
+                    # Count the request against the budget now so that concurrent threads don't
+                    # overshoot it before the response headers tell us the actual figure.
+                    if None != self.remaining:
+                        self.remaining -= 1
+                    return
+
+            time.sleep(wait)
+
+    def update(self, response):
+        """ Records the rate limit headers of a response. Returns True if the response is a rate
+        limit rejection and the request should be retried after the pause this sets."""
+        headers = response.headers
+
+        with self.lock:
+            if "X-RateLimit-Remaining" in headers:
+                self.remaining = int(headers["X-RateLimit-Remaining"])
+
+            if "X-RateLimit-Reset" in headers:
+                self.reset = int(headers["X-RateLimit-Reset"])
+
+            if response.status_code not in (403, 429):
+                self.secondary_count = 0
+                return False
+
+            now = time.time()
+
+            if "Retry-After" in headers:
+                pause = now + int(headers["Retry-After"])
+            elif headers.get("X-RateLimit-Remaining") == "0":
+                pause = self.reset + 1
+            elif response.status_code == 429 or "rate limit" in response.text.lower():
+                # A secondary rate limit without Retry-After: back off exponentially.
+                pause = now + self.secondary_backoff * 2 ** min(self.secondary_count, 5)
+                self.secondary_count += 1
+            else:
+                # A 403 for some other reason, such as lacking access to the repo.
+                return False
+
+            self.paused_until = max(self.paused_until, pause)
+            return True
+
+
+class GitHubClient:
+    """ Fetches commit history from the GitHub API on a bounded pool of threads sharing one
+    keep-alive session and rate limit budget. Responses are stored in the commit cache, and each
+    file's history is summarized once, however many references it has.
+
+    With since_filter, only the commits since the date that references to a file count from are
+    requested, 100 per page, following pagination until all of them have arrived."""
+
+    # Seconds to wait for a connection and then for each read of the response, so a stalled
+    # connection fails and is retried rather than holding a worker for good.
+    timeout = (10, 60)
+
+    def __init__(self, commit_cache, concurrency=8, max_retries=5, secondary_backoff=60, since_filter=False):
+        self.commit_cache = commit_cache
+        self.since_filter = since_filter
+        self.max_retries = max_retries
+        self.limiter = RateLimiter(secondary_backoff)
+
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(os.getenv("GITHUB_USER"), os.getenv("GITHUB_ACCESS_TOKEN"))
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="github")
+        self.futures = {}
+        self.since = {}  # The since day ordinal each file's Future was requested with
+        self.lock = threading.Lock()
+
+    def submit(self, file_key, since=None):
+        """ Starts fetching the history of the file identified by file_key (from get_file_key)
+        in the background, if it isn't already, and returns the Future for its summary (None
+        on failure). since is the day ordinal (from get_history_since) of the earliest commit
+        the caller needs; with since_filter, a file already requested with a later date is
+        requested again from the earlier one, and its Future replaced."""
+        since = since if self.since_filter else None
+
+        with self.lock:
+            if not self.covers(file_key, since):
+                self.futures[file_key] = self.executor.submit(self.fetch_summary, file_key, since)
+                self.since[file_key] = since
+
+            return self.futures[file_key]
+
+    def covers(self, file_key, since):
+        # Called with self.lock held
+        if not file_key in self.futures:
+            return False
+
+        requested = self.since[file_key]
+        return None == requested or (None != since and requested <= since)
+
+    def future(self, file_key):
+        """ Returns the Future for file_key's summary, submitting it if it hasn't been."""
+        with self.lock:
+            future = self.futures.get(file_key)
+
+        return future if None != future else self.submit(file_key)
+
+    def ready(self, file_key):
+        """ Returns whether file_key's history has been fetched (or failed)."""
+        return self.future(file_key).done()
+
+    def get(self, file_key):
+        """ Returns the history summary for file_key, waiting for it to be fetched if necessary."""
+        return self.future(file_key).result()
+
+    def add_repositories(self, repo_data):
+        """ Notes the dependent_repositories of a docset; only the mirror backend needs them."""
+        pass
+
+    def forget(self):
+        """ Drops the histories obtained so far, so that later requests get them again from the
+        commit cache, which revalidates entries past their TTL. Call it between scans only."""
+        with self.lock:
+            self.futures = {}
+            self.since = {}
+
+        self.commit_cache.forget()
+
+    def fetch_summary(self, file_key, since=None):
+        if None == since:
+            response_data = self.fetch(get_history_url(file_key))
+        else:
+            response_data = self.fetch(get_history_url(file_key, since, 100), paginate=True)
+
+            # With no commits since then, the most recent commit is older; one more request
+            # for a single commit gets it.
+            if [] == response_data:
+                response_data = self.fetch(get_history_url(file_key, per_page=1))
+
+        if None == response_data:
+            return None
+
+        return summarize_commit_history(response_data)
+
+    def commit_before(self, file_key, day):
+        """ Returns the SHA of the last commit to change the file on or before the day ordinal
+        day, or None if there's none (or it couldn't be obtained)."""
+        response_data = self.fetch(get_history_url(file_key, per_page=1, until=day))
+        return response_data[0]["sha"] if response_data else None
+
+    def fetch_file(self, file_key, commit):
+        """ Returns the blob SHA and content (as bytes, or None if not available) of the file at
+        commit, or None if the file couldn't be obtained."""
+        owner, repo, _, path = file_key
+        response = self.request("GET", f"{API_URL}/repos/{owner}/{repo}/contents/{path}?ref={commit}")
+
+        if None == response or response.status_code != 200:
+            return None
+
+        # Files over 1 MB come without content, which fetch_blob can then get.
+        profile.count("blobs_fetched")
+        data = response.json()
+        content = base64.b64decode(data["content"]) if "base64" == data.get("encoding") and data.get("content") else None
+        return data["sha"], content
+
+    def fetch_blob(self, file_key, blob):
+        """ Returns the content of a blob of the file's repository as bytes, or None if it
+        couldn't be obtained."""
+        owner, repo = file_key[:2]
+        response = self.request("GET", f"{API_URL}/repos/{owner}/{repo}/git/blobs/{blob}")
+
+        if None == response or response.status_code != 200:
+            return None
+
+        profile.count("blobs_fetched")
+        return base64.b64decode(response.json()["content"])
+
+    def fetch(self, history_url, paginate=False):
+        cached = self.commit_cache.get(history_url)
+
+        if None != cached and cached["fresh"]:
+            return cached["data"]
+
+        # Revalidate a stale cache entry with a conditional request; a 304 response means the
+        # cached data is still current and doesn't count against the API rate limit.
+        headers = {}
+
+        if None != cached:
+            if None != cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+
+            if None != cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+
+        response = self.request("GET", history_url, headers=headers)
+
+        if None == response:
+            return None
+
+        if response.status_code == 304 and None != cached:
+            profile.count("http_304")
+            self.commit_cache.revalidated(history_url)
+            return cached["data"]
+
+        if response.status_code == 200:
+            response_data = response.json()
+            etag, last_modified = response.headers.get("ETag"), response.headers.get("Last-Modified")
+
+            # Later pages hold older commits, so if the first page is unchanged, so are they;
+            # the whole history is cached with the first page's validators.
+            while paginate and "next" in response.links:
+                response = self.request("GET", response.links["next"]["url"])
+
+                if None == response or response.status_code != 200:
+                    return None
+
+                response_data.extend(response.json())
+
+            self.commit_cache.put(history_url, response_data, etag, last_modified)
+            return response_data
+
+        return None
+
+    def request(self, method, url, **kwargs):
+        """ Makes a request once the rate limit allows, retrying after rate limit rejections,
+        connection failures, and server errors. Returns the response, or None if it failed."""
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+
+            profile.count("api_calls")
+            start = time.perf_counter()
+
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                profile.count("api_errors")
+                report("WARNING", "Request failed", str(e).replace(",", ";"), url)
+                time.sleep(2 ** attempt)
+                continue
+
+            elapsed = time.perf_counter() - start
+            rate_limited = self.limiter.update(response)
+            profile.request(elapsed, self.limiter.remaining, self.limiter.reset)
+
+            if rate_limited:
+                profile.count("rate_limited")
+                continue
+
+            if response.status_code < 500:
+                return response
+
+            time.sleep(2 ** attempt)
+
+        return None
+
+    def close(self):
+        # Histories still queued are no longer needed, as when a consumer stops iter_coderefs early.
+        self.executor.shutdown(cancel_futures=True)
+        self.session.close()
+
+
+class GraphQLClient(GitHubClient):
+    """ Fetches commit history with the GitHub GraphQL API, querying the history of up to
+    batch_size files of the same repo and branch in one request. Files are queued until a batch
+    is full or their history is needed. Cached entries carry no ETag, because GraphQL has no
+    conditional requests, so stale entries are fetched again."""
+
+    # One aliased history connection per file. Each requests at most 100 commits, so a query
+    # costs about one point per 100 files; rateLimit reports the actual cost and budget.
+    query_template = """query({parameters}) {{
+  rateLimit {{ cost remaining resetAt }}
+  repository(owner: $owner, name: $name) {{
+    object(expression: $branch) {{
+      ... on Commit {{
+{histories}
+      }}
+    }}
+  }}
+}}"""
+
+    def __init__(self, commit_cache, concurrency=8, batch_size=25, max_retries=5, secondary_backoff=60, since_filter=False):
+        super().__init__(commit_cache, concurrency, max_retries, secondary_backoff, since_filter)
+        self.batch_size = batch_size
+        self.queued = {}  # (file key, since, Future) tuples awaiting a query, by (owner, repo, branch)
+
+    def submit(self, file_key, since=None):
+        since = since if self.since_filter else None
+
+        with self.lock:
+            if self.covers(file_key, since):
+                return self.futures[file_key]
+
+            future = Future()
+            self.futures[file_key] = future
+            self.since[file_key] = since
+            summary = self.cached_summary(file_key, since)
+
+            if None != summary:
+                future.set_result(summary)
+                return future
+
+            batch = self.queued.setdefault(file_key[:3], [])
+            batch.append((file_key, since, future))
+
+            if len(batch) >= self.batch_size:
+                self.dispatch(file_key[:3])
+
+            return future
+
+    def cached_summary(self, file_key, since):
+        # Returns the summary of a fresh cache entry stored by fetch_batch (or the REST backend),
+        # or None. Histories without a since date are the latest 100 commits, where the REST
+        # backend's are its first page of 30, so they're cached under a URL of their own.
+        cached = self.commit_cache.get(get_history_url(file_key, since, 100))
+
+        if None == cached or not cached["fresh"]:
+            return None
+
+        if None != since and [] == cached["data"]:
+            cached = self.commit_cache.get(get_history_url(file_key, per_page=1))
+
+            if None == cached or not cached["fresh"]:
+                return None
+
+        return summarize_commit_history(cached["data"])
+
+    def get(self, file_key):
+        future = self.future(file_key)
+
+        # The file may be waiting for its batch to fill; we need it now, so send what we have.
+        if not future.done():
+            self.flush()
+
+        return future.result()
+
+    def flush(self):
+        """ Queries the histories of all queued files, however small their batches."""
+        with self.lock:
+            for repo_key in list(self.queued.keys()):
+                self.dispatch(repo_key)
+
+    def dispatch(self, repo_key):
+        # Called with self.lock held
+        entries = self.queued.pop(repo_key)
+        self.executor.submit(self.fetch_batch, repo_key, entries)
+
+    def fetch_batch(self, repo_key, entries):
+        histories, latest = {}, {}
+
+        try:
+            histories, latest = self.query_histories(repo_key, [entry[:2] for entry in entries])
+        except Exception as e:
+            report("ERROR", "GraphQL history query failed", str(e).replace(",", ";"), "/".join(repo_key))
+        finally:
+            # Every Future must be resolved, or get() would wait forever, so a file whose
+            # history can't be stored or summarized fails on its own.
+            for i, (file_key, since, future) in enumerate(entries):
+                try:
+                    summary = self.store_history(file_key, since, histories.get(i), latest.get(i))
+                except Exception as e:
+                    report("ERROR", "Could not summarize GraphQL history", str(e).replace(",", ";"), "/".join(file_key))
+                    summary = None
+
+                future.set_result(summary)
+
+    def store_history(self, file_key, since, commits, latest_commits):
+        # Stores a file's history from a query in the commit cache, as the REST backend would
+        # have, and returns its summary, or None if the query didn't return it.
+        if None == commits:
+            return None
+
+        self.commit_cache.put(get_history_url(file_key, since, 100), commits)
+
+        if None != since:
+            # With no commits since then, the most recent commit is the latest one.
+            if [] == commits:
+                commits = latest_commits
+
+                if None == commits:
+                    return None
+
+                self.commit_cache.put(get_history_url(file_key, per_page=1), commits)
+
+        return summarize_commit_history(commits)
+
+    def query_histories(self, repo_key, requests):
+        """ Queries the history of each (file key, since) request, following pagination for those
+        with a since date. Returns two dictionaries of request index to commits, in the form of
+        the REST commits API: the histories that the queries returned in full, and for requests
+        with a since date, the latest commit."""
+        histories, latest = {}, {}
+        cursors = {i: None for i in range(len(requests))}  # Pages still to query, by request index
+
+        while len(cursors) > 0:
+            commit = self.query_page(repo_key, requests, cursors)
+            next_cursors = {}
+
+            for i, cursor in cursors.items():
+                history = commit.get(f"file{i}")
+
+                if None == history:
+                    # A history missing any of its pages would give wrong counts.
+                    histories.pop(i, None)
+                    continue
+
+                histories.setdefault(i, []).extend(self.rest_commits(history))
+
+                if None != commit.get(f"latest{i}"):
+                    latest[i] = self.rest_commits(commit[f"latest{i}"])
+
+                page_info = history.get("pageInfo")
+
+                if None != page_info and page_info["hasNextPage"]:
+                    next_cursors[i] = page_info["endCursor"]
+
+            cursors = next_cursors
+
+        return histories, latest
+
+    def query_page(self, repo_key, requests, cursors):
+        # Queries one page of history for each request in cursors, returning the commit object
+        # that holds the aliased histories.
+        owner, repo, branch = repo_key
+        parameters = ["$owner: String!", "$name: String!", "$branch: String!"]
+        histories = []
+        variables = {"owner": owner, "name": repo, "branch": branch}
+        nodes = "nodes { oid authoredDate url }"
+
+        for i, cursor in cursors.items():
+            file_key, since = requests[i]
+            parameters.append(f"$path{i}: String!")
+            variables[f"path{i}"] = file_key[3]
+
+            if None == since:
+                histories.append(f"        file{i}: history(first: 100, path: $path{i}) {{ {nodes} }}")
+                continue
+
+            parameters += [f"$since{i}: GitTimestamp!", f"$after{i}: String"]
+            variables[f"since{i}"] = datetime.date.fromordinal(since).isoformat() + "T00:00:00Z"
+            variables[f"after{i}"] = cursor
+            histories.append(f"        file{i}: history(first: 100, path: $path{i}, since: $since{i}, after: $after{i}) "
+                f"{{ pageInfo {{ hasNextPage endCursor }} {nodes} }}")
+
+            if None == cursor:
+                histories.append(f"        latest{i}: history(first: 1, path: $path{i}) {{ {nodes} }}")
+
+        query = self.query_template.format(parameters=", ".join(parameters), histories="\n".join(histories))
+        response = self.request("POST", GRAPHQL_URL, json={"query": query, "variables": variables})
+
+        if None == response or response.status_code != 200:
+            return {}
+
+        result = response.json()
+
+        for error in result.get("errors") or []:
+            report("WARNING", "GraphQL query error", error.get("message", "").replace(",", ";"), f"{owner}/{repo}")
+
+        data = result.get("data") or {}
+        rate_limit = data.get("rateLimit")
+
+        if None != rate_limit:
+            profile.count("graphql_points", rate_limit["cost"])
+
+        return ((data.get("repository") or {}).get("object")) or {}
+
+    def rest_commits(self, history):
+        # GitTimestamps keep the author's UTC offset, where the REST API gives dates in UTC.
+        return [{"sha": node["oid"], "html_url": node["url"], "commit": {"author": {"date": get_utc_timestamp(node["authoredDate"])}}}
+            for node in history["nodes"]]
+
+
+def get_utc_timestamp(timestamp):
+    """ Returns an ISO 8601 timestamp with any UTC offset, such as a GraphQL GitTimestamp, in
+    the YYYY-MM-DDTHH:MM:SSZ form of the REST API."""
+    dt = datetime.datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return dt.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class MirrorClient(GitHubClient):
+    """ Obtains commit history from local, bare, blobless mirror clones of the dependent
+    repositories rather than the GitHub API. Each mirror is cloned or fetched once per run, in
+    the background as soon as a docset lists its repository, and each branch's history is read
+    with a single git log, from which the history of every file on it is indexed. Nothing counts
+    against the API rate limit, and the commit cache isn't used, because the mirrors are a cache
+    of their own.
+
+    remotes maps URL prefixes to replacements, as git's url.<base>.insteadOf does, so mirrors
+    can be cloned from somewhere other than GitHub, such as file:// URLs for testing."""
+
+    def __init__(self, commit_cache, mirror_folder="mirrors", remotes=None, concurrency=8):
+        super().__init__(commit_cache, concurrency)
+        self.mirror_folder = mirror_folder
+        self.remotes = remotes or {}
+        self.repositories = {}  # Repository URL, by (owner, repo) as in file keys
+        self.updates = {}       # Future for each mirror's clone or fetch, by (owner, repo)
+        self.indexes = {}       # Future for each branch's history index, by (owner, repo, branch)
+
+        # Mirrors are updated and indexed on their own threads, so the threads summarizing file
+        # histories never hold up the work they wait for.
+        self.updater = ThreadPoolExecutor(concurrency, thread_name_prefix="mirror")
+
+    def add_repositories(self, repo_data):
+        for repo in repo_data:
+            # Repository URLs are of the form https://github.com/{owner}/{repo}
+            url = repo.get("url", "").rstrip("/")
+            parts = urlparse(url).path.strip("/").split("/")
+
+            if 2 == len(parts):
+                self.update((parts[0].lower(), parts[1].lower()), url)
+
+    def forget(self):
+        # Mirrors are fetched and indexed again when next needed.
+        super().forget()
+
+        with self.lock:
+            self.updates = {}
+            self.indexes = {}
+
+    def update(self, repo_key, url=None):
+        """ Starts updating the mirror of repo_key, if it isn't already, and returns the Future
+        for the mirror's path (None on failure)."""
+        with self.lock:
+            if not repo_key in self.updates:
+                self.repositories[repo_key] = url or self.repositories.get(repo_key) or "https://github.com/" + "/".join(repo_key)
+                self.updates[repo_key] = self.updater.submit(self.update_mirror, repo_key)
+
+            return self.updates[repo_key]
+
+    def update_mirror(self, repo_key):
+        remote = self.repositories[repo_key]
+
+        for prefix, replacement in self.remotes.items():
+            if remote.startswith(prefix):
+                remote = replacement + remote[len(prefix):]
+                break
+
+        path = os.path.abspath(os.path.join(self.mirror_folder, *repo_key)) + ".git"
+
+        # A blobless clone has every commit and tree, which is all git log needs, without the
+        # file contents.
+        if os.path.exists(path):
+            args = ["git", "-C", path, "fetch", "--quiet", "--prune"]
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            args = ["git", "clone", "--quiet", "--mirror", "--filter=blob:none", remote, path]
+
+        profile.count("git_invocations")
+        profile.count("mirror_updates")
+        completed = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8", errors="replace")
+
+        if 0 != completed.returncode:
+            if not os.path.exists(os.path.join(path, "HEAD")):
+                report("ERROR", "Could not clone repository mirror", " ".join(completed.stderr.split()).replace(",", ";"), remote)
+                return None
+
+            report("WARNING", "Could not update repository mirror; using it as is", " ".join(completed.stderr.split()).replace(",", ";"), remote)
+
+        return path
+
+    def index(self, branch_key):
+        """ Returns the Future for the history index of branch_key, an (owner, repo, branch)
+        tuple, starting to build it if necessary."""
+        update = self.update(branch_key[:2])
+
+        with self.lock:
+            if not branch_key in self.indexes:
+                self.indexes[branch_key] = self.updater.submit(self.index_branch, branch_key, update)
+
+            return self.indexes[branch_key]
+
+    def index_branch(self, branch_key, update):
+        """ Reads the branch's history from its mirror with one git log. Returns a tuple of the
+        list of (sha, date) commits, newest first, and a dictionary of each path to the indexes
+        in that list of the commits that changed it, or None on failure."""
+        owner, repo, branch = branch_key
+        mirror = update.result()
+
+        if None == mirror:
+            return None
+
+        commits = []
+        paths = {}
+
+        # Each commit is a \0-prefixed line with its hash and UTC author date, followed by the
+        # names of the files it changed. Limiting the log to the referenced paths would make git
+        # match every path against every pathspec, which is far slower than reading it all.
+        args = ["git", "-C", mirror, "-c", "core.quotepath=off", "log", branch, "--no-renames", "--name-only",
+            "--date=format-local:%Y-%m-%dT%H:%M:%SZ", "--format=%x00%H %ad", "--"]
+
+        profile.count("git_invocations")
+        p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8",
+            errors="replace", env=dict(os.environ, TZ="UTC"))
+
+        for line in p.stdout:
+            line = line.rstrip("\n")
+
+            if 0 == len(line):
+                continue
+
+            if line.startswith("\0"):
+                commits.append(tuple(line[1:].split(" ", 1)))
+            else:
+                paths.setdefault(line, []).append(len(commits) - 1)
+
+        _, err = p.communicate()
+
+        if 0 != p.returncode:
+            report("ERROR", "Could not read mirror history", " ".join(err.split()).replace(",", ";"), f"{owner}/{repo}/{branch}")
+            return None
+
+        return commits, paths
+
+    def fetch_summary(self, file_key, since=None):
+        index = self.index(file_key[:3]).result()
+
+        if None == index:
+            return None
+
+        # A file without commits gets an empty history, as from the API.
+        commits, paths = index
+        html_url = self.repositories[file_key[:2]] + "/commit/"
+
+        return summarize_commit_history([{"sha": commits[i][0], "html_url": html_url + commits[i][0],
+            "commit": {"author": {"date": commits[i][1]}}} for i in paths.get(file_key[3], [])])
+
+    def commit_before(self, file_key, day):
+        index = self.index(file_key[:3]).result()
+
+        if None == index:
+            return None
+
+        # Dates have the same format, so they compare as strings.
+        commits, paths = index
+        end = datetime.date.fromordinal(day).strftime("%Y-%m-%dT23:59:59Z")
+
+        for i in paths.get(file_key[3], []):
+            if commits[i][1] <= end:
+                return commits[i][0]
+
+        return None
+
+    def fetch_file(self, file_key, commit):
+        # The blob SHA comes from the mirror's trees; a blobless mirror fetches the content
+        # itself only when fetch_blob asks for it.
+        completed = self.git(file_key, ["rev-parse", "--verify", "--quiet", f"{commit}:{file_key[3]}"])
+        return (completed.stdout.decode().strip(), None) if None != completed else None
+
+    def fetch_blob(self, file_key, blob):
+        completed = self.git(file_key, ["cat-file", "blob", blob])
+
+        if None == completed:
+            return None
+
+        profile.count("blobs_fetched")
+        return completed.stdout
+
+    def git(self, file_key, args):
+        """ Runs git with args in the mirror of the file's repository. Returns the completed
+        process, or None on failure."""
+        mirror = self.update(file_key[:2]).result()
+
+        if None == mirror:
+            return None
+
+        profile.count("git_invocations")
+        completed = subprocess.run(["git", "-C", mirror] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        if 0 != completed.returncode:
+            message = " ".join(completed.stderr.decode("utf-8", "replace").split()).replace(",", ";")
+            report("WARNING", "Could not read file from mirror", message or "Not found", "/".join(file_key))
+            return None
+
+        return completed
+
+    def close(self):
+        super().close()
+        self.updater.shutdown()
+
+
+def open_github_client(commit_cache, github_config):
+    """ Creates the client for the backend selected by the "github" section of config.json."""
+    backend = github_config.get("backend", "rest")
+    concurrency = github_config.get("concurrency", 8)
+    since_filter = github_config.get("since_filter", False)
+
+    if backend == "mirror":
+        return MirrorClient(commit_cache, github_config.get("mirror_folder", "mirrors"),
+            github_config.get("mirror_remotes"), concurrency)
+
+    if backend == "graphql":
+        return GraphQLClient(commit_cache, concurrency, github_config.get("graphql_batch_size", 25),
+            since_filter=since_filter)
+
+    if backend != "rest":
+        report("WARNING", "Unknown GitHub backend", "Using rest", backend)
+
+    return GitHubClient(commit_cache, concurrency, since_filter=since_filter)
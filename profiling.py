@@ -0,0 +1,76 @@
+import contextlib
+import threading
+import time
+
+class Profile:
+    """ Wall time per stage, event counters, and GitHub request latencies for a docset, which
+    --profile reports at the end of each docset. Stages can overlap, because commit histories
+    are fetched while the scan continues."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.stages = {}
+            self.counters = {}
+            self.latencies = []
+            self.rate_limit_remaining = None
+            self.rate_limit_reset = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Adds the wall time spent in the with block to the named stage."""
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0) + elapsed
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def request(self, seconds, remaining=None, reset=None):
+        """ Records the latency of a GitHub request and the rate limit budget it reported."""
+        with self.lock:
+            self.latencies.append(seconds)
+
+            if None != remaining:
+                self.rate_limit_remaining = remaining
+                self.rate_limit_reset = reset
+
+    def summary(self):
+        """ Returns the profile as a dictionary suitable for JSON."""
+        with self.lock:
+            latencies = sorted(self.latencies)
+
+            def percentile(p):
+                # Nearest-rank percentile, in milliseconds
+                if len(latencies) == 0:
+                    return None
+
+                return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000, 1)
+
+            return {
+                "total_seconds": round(time.perf_counter() - self.started, 3),
+                "stages": {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                "counters": dict(self.counters),
+                "http": {
+                    "requests": len(latencies),
+                    "p50_ms": percentile(0.50),
+                    "p95_ms": percentile(0.95),
+                    "rate_limit_remaining": self.rate_limit_remaining,
+                    "rate_limit_reset": self.rate_limit_reset
+                }
+            }
+
+
+# The profile of the docset being processed, shared by all modules and threads.
+profile = Profile()
@@ -0,0 +1,236 @@
+import csv
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+from utilities import get_next_filename, report
+
+# pyarrow is needed only for Parquet output.
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# The columns of the results, with the SQLite type of each. The fields of CodeRef are in
+# this order, followed by those of SNIPPET_COLUMNS.
+RESULT_COLUMNS = [
+    ("docset", "TEXT"), ("file", "TEXT"), ("articleUrl", "TEXT"), ("ms.service", "TEXT"),
+    ("ms.subservice", "TEXT"), ("ms.author", "TEXT"), ("ms.reviewer", "TEXT"), ("ms.date", "TEXT"),
+    ("lastArticleCommit", "TEXT"), ("refLine", "INTEGER"), ("refType", "TEXT"), ("refDetail", "TEXT"),
+    ("repoUrl", "TEXT"), ("refUrl", "TEXT"), ("commitsSinceMsDate", "INTEGER"),
+    ("commitsSinceLastLocalCommit", "INTEGER"), ("mostRecentCommit", "TEXT"), ("mostRecentCommitUrl", "TEXT")
+]
+
+# Columns added when config.json has a snippet_check section
+SNIPPET_COLUMNS = [("snippetChanged", "TEXT")]
+
+RESULT_KEY = ["docset", "file", "refLine", "refUrl"]
+
+
+class CodeRef(NamedTuple):
+    """ The results for one external code reference in an article, with fields in the order of
+    RESULT_COLUMNS and SNIPPET_COLUMNS. snippet_changed is "yes" or "no" when snippet checks are
+    enabled and can tell, "" when they can't, and None when they're disabled."""
+    docset: str
+    file: str
+    article_url: str
+    ms_service: str
+    ms_subservice: str
+    ms_author: str
+    ms_reviewer: str
+    ms_date: str
+    last_article_commit: str
+    ref_line: int
+    ref_type: str
+    ref_detail: str
+    repo_url: str
+    ref_url: str
+    commits_since_ms_date: int
+    commits_since_last_local_commit: int
+    most_recent_commit: str
+    most_recent_commit_url: str
+    snippet_changed: str = None
+
+
+def get_result_columns(config):
+    """ Returns the columns of the results for config.json."""
+    return RESULT_COLUMNS + (SNIPPET_COLUMNS if None != config.get("snippet_check") else [])
+
+
+class CsvSink:
+    """ Writes a docset's results (CodeRefs or rows in the same order) to a new
+    <name>_<date>-<number>.csv file, as csv.writer does. Rows are cut to the given columns."""
+
+    def __init__(self, prefix, columns=RESULT_COLUMNS):
+        self.filename = get_next_filename(prefix)
+        self.name = self.filename + ".csv"
+        self.file = open(self.name, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+        self.width = len(columns)
+
+    def writerows(self, rows):
+        self.writer.writerows(row[:self.width] for row in rows)
+
+    def close(self, complete=True):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(None == exc_type)
+
+
+class SqliteSink:
+    """ Writes a docset's results to a table in a SQLite database shared by all docsets and runs,
+    keyed by docset, file, refLine, and refUrl. Rows are upserted, so the table holds the latest
+    results of each docset; scanned is the time of the run that last found the reference, and
+    changed the time of the run that last changed its values. When a run completes, references
+    of the docset that it didn't find are deleted. Rows are committed in batches of
+    commit_rows. Columns missing from an existing table are added; those not in columns are
+    left NULL."""
+
+    # Sinks of docsets processed at once share a connection to each database, with the number
+    # of sinks using it, by path. They're written from one thread, where a second connection
+    # would wait for ever on the first's open write transaction.
+    connections = {}
+    connections_lock = threading.Lock()
+
+    def __init__(self, path, prefix, docset, columns=RESULT_COLUMNS, commit_rows=1000):
+        # The profile summary, if any, still needs a file name of its own.
+        self.filename = get_next_filename(prefix, "profile.json")
+        self.name = f"{path} ({docset})"
+        self.docset = docset
+        self.scanned = time.time()
+        self.commit_rows = commit_rows
+        self.uncommitted = 0
+
+        # The timeout lets other processes take turns writing, and write-ahead logging lets
+        # dashboards read while a run writes.
+        self.path = os.path.abspath(path)
+
+        with self.connections_lock:
+            if not self.path in self.connections:
+                db = sqlite3.connect(self.path, timeout=60)
+                db.execute("PRAGMA journal_mode=WAL")
+                self.connections[self.path] = [db, 0]
+
+            self.connections[self.path][1] += 1
+            self.db = self.connections[self.path][0]
+
+        definitions = ", ".join(f'"{name}" {type}' for name, type in columns)
+        key = ", ".join(f'"{name}"' for name in RESULT_KEY)
+        self.db.execute(f"""CREATE TABLE IF NOT EXISTS coderefs ({definitions},
+            scanned REAL NOT NULL, changed REAL NOT NULL, PRIMARY KEY ({key}))""")
+
+        existing = [row[1] for row in self.db.execute("PRAGMA table_info(coderefs)")]
+
+        for name, type in columns:
+            if not name in existing:
+                self.db.execute(f'ALTER TABLE coderefs ADD COLUMN "{name}" {type}')
+
+        self.db.execute('CREATE INDEX IF NOT EXISTS coderefs_service ON coderefs ("ms.service", "ms.subservice")')
+        self.db.execute('CREATE INDEX IF NOT EXISTS coderefs_ref ON coderefs ("refUrl")')
+        self.db.commit()
+
+        names = [name for name, _ in columns]
+        values = [name for name in names if not name in RESULT_KEY]
+        updates = ", ".join(f'"{name}" = excluded."{name}"' for name in values)
+        differs = " OR ".join(f'"{name}" IS NOT excluded."{name}"' for name in values)
+        self.width = len(names)
+
+        self.upsert = f"""INSERT INTO coderefs ({", ".join(f'"{name}"' for name in names)}, scanned, changed)
+            VALUES ({", ".join("?" * (len(names) + 2))})
+            ON CONFLICT ({key}) DO UPDATE SET {updates}, scanned = excluded.scanned,
+            changed = CASE WHEN {differs} THEN excluded.changed ELSE changed END"""
+
+    def writerows(self, rows):
+        rows = [list(row[:self.width]) + [self.scanned, self.scanned] for row in rows]
+        self.db.executemany(self.upsert, rows)
+        self.uncommitted += len(rows)
+
+        if self.uncommitted >= self.commit_rows:
+            self.db.commit()
+            self.uncommitted = 0
+
+    def close(self, complete=True):
+        self.db.commit()
+
+        if complete:
+            self.db.execute("DELETE FROM coderefs WHERE docset = ? AND scanned < ?", (self.docset, self.scanned))
+            self.db.commit()
+
+        with self.connections_lock:
+            self.connections[self.path][1] -= 1
+
+            if 0 == self.connections[self.path][1]:
+                del self.connections[self.path]
+                self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(None == exc_type)
+
+
+class ParquetSink:
+    """ Writes a docset's results to a new <name>_<date>-<number>.parquet file, a row group at a
+    time. Requires pyarrow."""
+
+    # SQLite column types as Arrow types
+    types = {"TEXT": "string", "INTEGER": "int64"}
+
+    def __init__(self, prefix, columns=RESULT_COLUMNS, row_group_size=10000):
+        self.filename = get_next_filename(prefix, "parquet")
+        self.name = self.filename + ".parquet"
+        self.schema = pyarrow.schema([(name, self.types[type]) for name, type in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(self.name, self.schema)
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def writerows(self, rows):
+        self.rows.extend(rows)
+
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) > 0:
+            columns = [list(column) for column in zip(*self.rows)][:len(self.schema)]
+            self.writer.write_table(pyarrow.Table.from_arrays(columns, schema=self.schema))
+            self.rows = []
+
+    def close(self, complete=True):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(None == exc_type)
+
+
+def open_result_sink(output_config, prefix, docset, columns=RESULT_COLUMNS):
+    """ Opens the sink for a docset's results selected by the "output" section of config.json;
+    CSV unless the section says otherwise. prefix is the start of the docset's file names, and
+    columns those of get_result_columns."""
+    output_config = output_config or {}
+    format = output_config.get("format", "csv")
+
+    if format == "sqlite":
+        return SqliteSink(output_config.get("path", "coderefs.db"), prefix, docset, columns)
+
+    if format == "parquet":
+        if None != pyarrow:
+            return ParquetSink(prefix, columns)
+
+        report("ERROR", "Parquet output requires the pyarrow package", "Writing CSV instead", docset)
+    elif format != "csv":
+        report("WARNING", "Unknown output format", "Writing CSV instead", format)
+
+    return CsvSink(prefix, columns)
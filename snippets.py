@@ -0,0 +1,342 @@
+import collections
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from profiling import profile
+from utilities import date_ordinal, get_file_key, report
+
+class BlobCache:
+    """ Persistent, content-addressed cache of the files that code references embed. Blobs are
+    keyed by their git blob SHA, so each version of a file is stored once however many commits
+    and references share it. The cache also records the blob of each file at each commit that's
+    been looked up, and the digest of each region (id, range, or whole file) taken from a blob,
+    so that a region is extracted only once across all articles and runs. Commits and blobs
+    never change, so nothing in the cache goes stale."""
+
+    def __init__(self, path=":memory:", expire_days=90):
+        # Entries not used in expire_days are evicted.
+        self.path = path
+        self.expire = expire_days * 86400
+        self.lock = threading.Lock()
+
+        # Times that blobs and regions were used, by SHA and by (blob, selector), written
+        # together by write_accessed so that lookups don't hold the database's write lock.
+        self.blobs_accessed = {}
+        self.regions_accessed = {}
+
+        # As for the commit cache, runs can share the database, and should it be unavailable,
+        # lookups miss and writes are skipped.
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS blobs (
+            sha TEXT PRIMARY KEY, accessed REAL NOT NULL, content BLOB NOT NULL)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS versions (
+            repo TEXT NOT NULL, commit_sha TEXT NOT NULL, path TEXT NOT NULL, blob TEXT NOT NULL,
+            PRIMARY KEY (repo, commit_sha, path))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS regions (
+            blob TEXT NOT NULL, selector TEXT NOT NULL, accessed REAL NOT NULL, digest TEXT NOT NULL,
+            PRIMARY KEY (blob, selector))""")
+        self.db.commit()
+
+    def get_version(self, repo, commit, path):
+        """ Returns the SHA of the blob of path at commit, or None if it hasn't been looked up."""
+        with self.lock:
+            row = self.read("SELECT blob FROM versions WHERE repo = ? AND commit_sha = ? AND path = ?", (repo, commit, path), path)
+
+        return row[0] if None != row else None
+
+    def put_version(self, repo, commit, path, blob):
+        with self.lock:
+            self.write("INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)", [(repo, commit, path, blob)], path)
+
+    def get_blob(self, sha):
+        """ Returns the content of the blob as bytes, or None if it isn't cached."""
+        with self.lock:
+            row = self.read("SELECT content FROM blobs WHERE sha = ?", (sha,), sha)
+
+            if None == row:
+                profile.count("blob_cache_misses")
+                return None
+
+            profile.count("blob_cache_hits")
+            self.blobs_accessed[sha] = time.time()
+            return row[0]
+
+    def put_blob(self, sha, content):
+        with self.lock:
+            self.write("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?)", [(sha, time.time(), content)], sha)
+
+    def get_region(self, blob, selector):
+        """ Returns the digest of a region of the blob ("" if the blob lacks the region), or None
+        if it hasn't been computed."""
+        with self.lock:
+            row = self.read("SELECT digest FROM regions WHERE blob = ? AND selector = ?", (blob, selector), blob)
+
+            if None == row:
+                return None
+
+            self.regions_accessed[(blob, selector)] = time.time()
+            return row[0]
+
+    def put_region(self, blob, selector, digest):
+        with self.lock:
+            self.write("INSERT OR REPLACE INTO regions VALUES (?, ?, ?, ?)", [(blob, selector, time.time(), digest)], blob)
+
+    def read(self, query, parameters, item):
+        # Called with self.lock held. Returns the first row of query, or None if there's none or
+        # the database is unavailable.
+        try:
+            return self.db.execute(query, parameters).fetchone()
+        except sqlite3.Error as e:
+            report("WARNING", "Could not read blob cache", str(e).replace(",", ";"), item)
+            return None
+
+    def write(self, statement, rows, item):
+        # Called with self.lock held. Runs statement for each of rows in a transaction of its
+        # own, and returns whether it succeeded.
+        try:
+            self.db.executemany(statement, rows)
+            self.db.commit()
+            return True
+        except sqlite3.Error as e:
+            self.db.rollback()
+            report("WARNING", "Could not write blob cache", str(e).replace(",", ";"), item)
+            return False
+
+    def write_accessed(self):
+        """ Writes the times that blobs and regions were used since this was last called."""
+        with self.lock:
+            self.write("UPDATE blobs SET accessed = ? WHERE sha = ?",
+                [(accessed, sha) for sha, accessed in self.blobs_accessed.items()], self.path)
+            self.write("UPDATE regions SET accessed = ? WHERE blob = ? AND selector = ?",
+                [(accessed, blob, selector) for (blob, selector), accessed in self.regions_accessed.items()], self.path)
+            self.blobs_accessed = {}
+            self.regions_accessed = {}
+
+    def close(self):
+        """ Evicts expired entries, then closes the database."""
+        self.write_accessed()
+
+        with self.lock:
+            expired = time.time() - self.expire
+            self.write("DELETE FROM blobs WHERE accessed < ?", [(expired,)], self.path)
+            self.write("DELETE FROM regions WHERE accessed < ?", [(expired,)], self.path)
+            self.db.close()
+
+
+def get_region_lines(lines, type, detail):
+    """ Returns the lines of a file that a code reference embeds, or None if the file lacks
+    them. type and detail are those of a CodeReference: an id names a region between <id> and
+    </id> tags (usually in comments) or after #region id; a range is a comma-separated list of
+    1-based line numbers and ranges, such as 1-5,9 or 12-."""
+    if "whole_file" == type:
+        return lines
+
+    if "id" == type:
+        tag = re.compile(f"<{re.escape(detail)}>", re.IGNORECASE)
+        region = re.compile(f"\\s*#\\s*region\\s+{re.escape(detail)}\\s*$", re.IGNORECASE)
+
+        for start, line in enumerate(lines):
+            if None != tag.search(line):
+                end_tag = re.compile(f"</{re.escape(detail)}>", re.IGNORECASE)
+
+                for end in range(start + 1, len(lines)):
+                    if None != end_tag.search(lines[end]):
+                        return lines[start + 1:end]
+
+                return None
+
+            if None != region.match(line):
+                # #region blocks nest, so the region ends at the #endregion at the same depth.
+                depth = 0
+
+                for end in range(start + 1, len(lines)):
+                    if re.match(r"\s*#\s*region\b", lines[end]):
+                        depth += 1
+                    elif re.match(r"\s*#\s*endregion\b", lines[end]):
+                        if 0 == depth:
+                            return lines[start + 1:end]
+
+                        depth -= 1
+
+                return None
+
+        return None
+
+    # Ranges are quoted in the detail so that Excel doesn't take them for dates.
+    selected = []
+
+    for part in detail.strip("'").split(","):
+        first, dash, last = part.strip().partition("-")
+
+        try:
+            first = int(first)
+            last = int(last) if "" != last else (len(lines) if dash else first)
+        except ValueError:
+            return None
+
+        selected.extend(lines[first - 1:last])
+
+    return selected if len(selected) > 0 else None
+
+
+def get_region_digest(content, type, detail):
+    """ Returns a digest of the region of content (bytes) that a code reference embeds, or "" if
+    content lacks the region. Line endings and trailing whitespace don't affect the digest, as
+    they don't affect the rendered snippet."""
+    lines = content.decode("utf-8", "replace").splitlines()
+    region = get_region_lines(lines, type, detail)
+
+    if None == region:
+        return ""
+
+    return hashlib.sha1("\n".join(line.rstrip() for line in region).encode("utf-8")).hexdigest()
+
+
+class SnippetChecker:
+    """ Determines whether the part of a file that a code reference embeds has changed since the
+    article's ms.date, by comparing that region of the file as of the last commit on or before
+    ms.date with the region at the most recent commit. Checks run on a pool of threads, after the
+    file's commit history arrives from github_client, which also provides the file's versions:
+    from the API or from a mirror, depending on the backend. Blobs and region digests are kept
+    in blob_cache."""
+
+    def __init__(self, github_client, blob_cache, concurrency=8):
+        self.github_client = github_client
+        self.blob_cache = blob_cache
+        self.executor = ThreadPoolExecutor(concurrency, thread_name_prefix="snippets")
+        self.futures = {}
+        self.lock = threading.Lock()
+
+        # Held while looking up a file's version at a commit, so each is fetched once.
+        self.version_locks = collections.defaultdict(threading.Lock)
+
+    def submit(self, ref, ms_date):
+        """ Starts checking the code reference ref (a CodeReference) against the article's
+        ms.date in the background, if it isn't already, and returns the Future for the result:
+        "yes" if the region changed, "no" if it didn't, or "" if that can't be determined."""
+        key = (get_file_key(ref.file_url), ms_date, ref.type, ref.detail)
+
+        with self.lock:
+            if not key in self.futures:
+                self.futures[key] = self.executor.submit(self.check, *key)
+
+            return self.futures[key]
+
+    def ready(self, ref, ms_date):
+        return self.submit(ref, ms_date).done()
+
+    def get(self, ref, ms_date):
+        with profile.stage("wait_snippet_check"):
+            return self.submit(ref, ms_date).result()
+
+    def check(self, file_key, ms_date, type, detail):
+        if None == file_key or None == ms_date:
+            return ""
+
+        # Waiting on the Future rather than calling get leaves the graphql backend's batches to
+        # fill, until the scan needs the history itself.
+        summary = self.github_client.future(file_key).result()
+
+        if None == summary or 0 == len(summary.dates):
+            return ""
+
+        # Without commits after ms.date, nothing can have changed.
+        day = date_ordinal(ms_date)
+
+        if summary.dates[-1] <= day:
+            return "no"
+
+        profile.count("snippets_compared")
+        head = summary.most_recent_url.rsplit("/", 1)[-1]
+        head_digest = self.get_digest(file_key, head, type, detail)
+
+        if None == head_digest:
+            return ""
+
+        if "" == head_digest:
+            report("WARNING", "Referenced snippet not found in current file", f"{type} {detail}", "/".join(file_key))
+            return ""
+
+        base = self.github_client.commit_before(file_key, day)
+
+        # A file created after ms.date had nothing to embed then.
+        if None == base:
+            return "yes"
+
+        base_digest = self.get_digest(file_key, base, type, detail)
+
+        if None == base_digest:
+            return ""
+
+        return "no" if base_digest == head_digest else "yes"
+
+    def get_digest(self, file_key, commit, type, detail):
+        """ Returns the digest of the region of the file at commit, "" if the file lacks the
+        region, or None if the file couldn't be obtained."""
+        repo, path = "/".join(file_key[:2]), file_key[3]
+        content = None
+
+        with self.version_locks[(repo, commit, path)]:
+            blob = self.blob_cache.get_version(repo, commit, path)
+
+            if None == blob:
+                version = self.github_client.fetch_file(file_key, commit)
+
+                if None == version:
+                    return None
+
+                blob, content = version
+                self.blob_cache.put_version(repo, commit, path, blob)
+
+                if None != content:
+                    self.blob_cache.put_blob(blob, content)
+
+        selector = f"{type}:{detail}"
+        digest = self.blob_cache.get_region(blob, selector)
+
+        if None != digest:
+            return digest
+
+        with self.version_locks[blob]:
+            if None == content:
+                content = self.blob_cache.get_blob(blob)
+
+            if None == content:
+                content = self.github_client.fetch_blob(file_key, blob)
+
+                if None == content:
+                    return None
+
+                self.blob_cache.put_blob(blob, content)
+
+        digest = get_region_digest(content, type, detail)
+        self.blob_cache.put_region(blob, selector, digest)
+        return digest
+
+    def forget(self):
+        """ Drops the results of checks so far, which depend on the histories that
+        github_client.forget drops. The blob cache stays valid, with the times its entries were
+        used written."""
+        with self.lock:
+            self.futures = {}
+
+        self.blob_cache.write_accessed()
+
+    def close(self):
+        self.executor.shutdown(cancel_futures=True)
+        self.blob_cache.close()
+
+
+def open_snippet_checker(github_client, snippet_config):
+    """ Creates the checker described by the "snippet_check" section of config.json, or returns
+    None if there's no such section."""
+    if None == snippet_config:
+        return None
+
+    blob_cache = BlobCache(snippet_config.get("blob_cache", "blob_cache.db"), snippet_config.get("expire_days", 90))
+    return SnippetChecker(github_client, blob_cache, snippet_config.get("concurrency", 8))
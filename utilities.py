@@ -1,21 +1,109 @@
+import bisect
+import collections
+import contextlib
 import datetime
+import functools
 import getopt
+import json
 import os
+import pathlib
+import posixpath
+import sys
+import threading
 from subprocess import Popen, PIPE
 import re
-import glob
-import requests
-from requests.auth import HTTPBasicAuth
 from datetime import datetime
+from typing import NamedTuple
+from profiling import profile
+
+# GITHUB_API_URL lets the script run against GitHub Enterprise or a local stub server.
+API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+
+class Diagnostic(NamedTuple):
+    """ A diagnostic reported while extracting code references. Its string form is a line of the
+    Script,Type,Message,Detail,Item CSV that the script prints."""
+    type: str
+    message: str
+    detail: str = ""
+    item: str = ""
+
+    def __str__(self):
+        return f"extract_coderefs, {self.type}, {self.message}, {self.detail}, {self.item}"
+
+
+# Diagnostics are printed unless the current thread is collecting them (see collect_reports)
+# or a handler is receiving them (see handle_reports). report_lock keeps lines printed by
+# different threads from running into each other.
+report_state = threading.local()
+report_lock = threading.Lock()
+report_handlers = []    # Those of the open handle_reports blocks, the latest last
+
+def report(type, message, detail="", item=""):
+    """ Outputs a diagnostic as a line of the Script,Type,Message,Detail,Item CSV."""
+    diagnostic = Diagnostic(type, message, str(detail), str(item))
+    collected = getattr(report_state, "collected", None)
+
+    if None != collected:
+        collected.append(diagnostic)
+    else:
+        emit_reports([diagnostic])
+
+
+def emit_reports(diagnostics, below=None):
+    """ Passes diagnostics, such as those from collect_reports, to the latest handler (or the
+    latest opened before the handler below) if there is one, and otherwise prints them."""
+    handlers = report_handlers[:]
+
+    if below in handlers:
+        handlers = handlers[:handlers.index(below)]
+
+    if len(handlers) > 0:
+        for diagnostic in diagnostics:
+            handlers[-1](diagnostic)
+    else:
+        print_reports(diagnostics)
+
+
+def print_reports(diagnostics):
+    """ Prints diagnostics together."""
+    with report_lock:
+        for diagnostic in diagnostics:
+            print(diagnostic)
+
+
+@contextlib.contextmanager
+def handle_reports(handler):
+    """ Passes the diagnostics reported by all threads to handler instead of printing them,
+    until the with block ends. The latest block still open gets them, even if blocks end out of
+    order, as those in generators can."""
+    report_handlers.append(handler)
+
+    try:
+        yield
+    finally:
+        report_handlers.remove(handler)
+
 
-def get_next_filename(prefix=None):    
-    """ Determine the next filename by incrementing 1 above the largest existing file number in the current folder for today's date."""
+@contextlib.contextmanager
+def collect_reports():
+    """ Collects the Diagnostics reported by the current thread into a list rather than emitting
+    them, so work done out of order (such as in worker processes) can output them in order."""
+    previous = getattr(report_state, "collected", None)
+    report_state.collected = []
+
+    try:
+        yield report_state.collected
+    finally:
+        report_state.collected = previous
+
+def get_next_filename(prefix=None, extension="csv"):    
+    """ Determine the next filename by incrementing 1 above the largest existing file number in the current folder for today's date, among files with the given extension."""
 
     from datetime import date
     today = date.today()
 
     date_pattern = prefix + '_' + str(today)
-    files = [f for f in os.listdir('.') if re.match(date_pattern + '-[0-9]+.csv', f)]
+    files = [f for f in os.listdir('.') if re.match(date_pattern + '-[0-9]+.' + extension, f)]
 
     if (len(files) == 0):
         next_num = 1
@@ -28,11 +116,12 @@ def get_next_filename(prefix=None):
 
 
 def parse_config_arguments(argv):
-    """ Parses an arguments list for take_inventory.py, returning config file name. Any additional arguments after the options are included in the tuple."""
+    """ Parses an arguments list for extract_coderefs.py, returning config file name, any additional arguments after the options, and a dictionary of the other options."""
     config_file = "config.json"
+    options = {"jobs": 1, "docsets": 1, "incremental": False, "profile": False}
 
     try:
-        opts, args = getopt.getopt(argv, 'hH?', ["config="])
+        opts, args = getopt.getopt(argv, 'hH?', ["config=", "jobs=", "docsets=", "incremental", "profile"])
     except getopt.GetoptError:
         return (None, None, None)
 
@@ -42,48 +131,359 @@ def parse_config_arguments(argv):
 
         if opt in ('--config'):
             config_file = arg
+
+        if opt in ('--jobs'):
+            if not arg.isdigit() or int(arg) < 1:
+                return (None, None, None)
+
+            options["jobs"] = int(arg)
+
+        if opt in ('--docsets'):
+            if not arg.isdigit() or int(arg) < 1:
+                return (None, None, None)
+
+            options["docsets"] = int(arg)
+
+        if opt in ('--incremental'):
+            options["incremental"] = True
+
+        if opt in ('--profile'):
+            options["profile"] = True
     
-    return (config_file, args)
+    return (config_file, args, options)
+
+
+# Indexes of last commit dates for local clones, keyed by the clone's top-level folder so
+# that docsets sharing a clone also share the index. folder_toplevels caches the lookup of
+# a docset folder's clone, and folder_prefixes that of the folder's path within it.
+# Concurrent docsets in one clone wait for the same index to be built through the clone's lock
+# in local_commit_locks.
+local_commit_indexes = {}
+local_commit_locks = {}
+folder_toplevels = {}
+folder_prefixes = {}
+
+def get_repo_toplevel(folder):
+    if folder not in folder_toplevels:
+        profile.count("git_invocations")
+        p = Popen(["git", "rev-parse", "--show-toplevel"], cwd=folder, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
+
+        if 0 == len(out):
+            report("WARNING", "Folder is not in a git repository", err.decode('ascii', 'replace').strip(), folder)
+            folder_toplevels[folder] = None
+        else:
+            folder_toplevels[folder] = os.path.normpath(out.decode("utf-8").strip())
+
+    return folder_toplevels[folder]
+
+
+def get_repo_path(folder, path):
+    """ Returns the path of path, which is in or under folder, relative to the top of the clone
+    containing folder, with / separators, as git names files. Returns None if folder isn't in
+    a clone or path is outside it. git reports the top of a clone with symlinks resolved, so
+    path is taken relative to folder, whose own path in the clone comes from git."""
+    if folder not in folder_prefixes:
+        profile.count("git_invocations")
+        p = Popen(["git", "rev-parse", "--show-prefix"], cwd=folder, stdout=PIPE, stderr=PIPE)
+        out, _ = p.communicate()
+        folder_prefixes[folder] = out.decode("utf-8").strip() if 0 == p.returncode else None
+
+    prefix = folder_prefixes[folder]
+
+    if None == prefix:
+        return None
+
+    repo_path = posixpath.normpath(prefix + os.path.relpath(path, folder).replace(os.sep, "/"))
+    return None if ".." == repo_path or repo_path.startswith("../") else repo_path
+
+
+def build_local_commit_index(repo_root, since_commit=None):
+    """ Walks the history of the repo at repo_root once and returns a dictionary of each path
+    (relative to repo_root, with / separators) to the mm/dd/yyyy date of its last commit. With
+    since_commit, only commits after since_commit are walked, so only the paths they touched
+    are in the index."""
+    index = {}
+    formatted_dates = {}
+    date = None
+
+    # Each commit is a \0-prefixed %ci line followed by the names of the files it touched. The
+    # log is newest first, so the first time we see a path gives its last commit. quotepath=off
+    # keeps non-ASCII paths as-is rather than octal-escaped and quoted.
+    args = ["git", "-c", "core.quotepath=off", "log", "--name-only", "--format=%x00%ci"]
+
+    if None != since_commit:
+        args.append(f"{since_commit}..HEAD")
+
+    profile.count("git_invocations")
+    p = Popen(args, cwd=repo_root, stdout=PIPE, stderr=PIPE, encoding="utf-8", errors="replace")
+
+    for line in p.stdout:
+        line = line.rstrip("\n")
+
+        if 0 == len(line):
+            continue
+
+        if line.startswith("\0"):
+            day = line[1:].split()[0]
+
+            if day not in formatted_dates:
+                # Reformat the yyyy-mm-dd commit date to a mm/dd/yyyy date string
+                formatted_dates[day] = datetime.strptime(day, "%Y-%m-%d").strftime('%m/%d/%Y')
+
+            date = formatted_dates[day]
+        elif line not in index:
+            index[line] = date
+
+    _, err = p.communicate()
+
+    if 0 != p.returncode:
+        report("WARNING", "Could not read local commit history", err.strip(), repo_root)
+
+    return index
 
 
 def get_last_local_commit(folder, full_path):
-    rel_path = os.path.relpath(full_path, folder)
-    # Folder is the repo root; rel_path if the file's relative location.
-    # --format=%ci provides simplest output to parse
-    p = Popen(f"git log -1 --format=%ci {rel_path}",
-        shell=True, cwd=folder, stdout=PIPE, stderr=PIPE, )
+    # Folder is the docset folder within a local clone. The first lookup for a clone reads its
+    # entire history in one pass; later lookups, from any docset in that clone, are dictionary hits.
+    repo_root = get_repo_toplevel(folder)
+    last_local_commit = None
+
+    if None != repo_root:
+        with local_commit_locks.setdefault(repo_root, threading.Lock()):
+            if repo_root not in local_commit_indexes:
+                with profile.stage("local_history"):
+                    local_commit_indexes[repo_root] = build_local_commit_index(repo_root)
 
-    out, err = p.communicate()        
+        last_local_commit = local_commit_indexes[repo_root].get(get_repo_path(folder, full_path))
 
-    if 0 == len(out):
-        print(f"extract_coderefs, WARNING, Could not obtain last local commit on article, {err.decode('ascii')}, {full_path}")
+    if None == last_local_commit:
+        report("WARNING", "Could not obtain last local commit on article", "", full_path)
         return datetime.today().strftime('%m/%d/%Y')
 
-    # Reformat the yyyy-mm-dd commit date to a mm/dd/yyyy date string
-    dt = datetime.strptime(out.split()[0].decode('ascii'), "%Y-%m-%d")
-    last_local_commit = dt.strftime('%m/%d/%Y')
     return last_local_commit
     
 
+def forget_local_commits(folder):
+    """ Drops the index of last commit dates for the clone containing folder, as after new
+    commits; the next lookup reads its history again."""
+    repo_root = get_repo_toplevel(folder)
+
+    if None != repo_root:
+        with local_commit_locks.setdefault(repo_root, threading.Lock()):
+            local_commit_indexes.pop(repo_root, None)
+
+
+def get_head_commit(folder):
+    """ Returns the SHA of the HEAD commit of the clone containing folder, or None."""
+    profile.count("git_invocations")
+    p = Popen(["git", "rev-parse", "HEAD"], cwd=folder, stdout=PIPE, stderr=PIPE)
+    out, _ = p.communicate()
+
+    if 0 != p.returncode:
+        return None
+
+    return out.decode("ascii").strip()
+
+
+def get_changed_files(folder, since_commit):
+    """ Returns the set of paths (relative to the top of the clone containing folder, with /
+    separators) that changed between since_commit and HEAD, or None if git can't tell, such as
+    when since_commit no longer exists."""
+    profile.count("git_invocations")
+    p = Popen(["git", "diff", "--name-only", "--no-renames", "-z", since_commit, "HEAD"],
+        cwd=folder, stdout=PIPE, stderr=PIPE)
+    out, _ = p.communicate()
+
+    if 0 != p.returncode:
+        return None
+
+    return set(name for name in out.decode("utf-8", "replace").split("\0") if len(name) > 0)
+
+
+def load_scan_state(state_path):
+    """ Loads the state saved by the last incremental run, or returns None if there isn't any."""
+    if not os.path.exists(state_path):
+        return None
+
+    try:
+        with open(state_path, encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except (OSError, ValueError):
+        report("WARNING", "Could not read incremental scan state", "Scanning all articles", state_path)
+        return None
+
+
+def get_article_state(metadata, coderefs, last_local_commit):
+    """ Returns the JSON form of an article's results, for the state of an incremental run."""
+    return [metadata.as_dict(), [ref.as_dict() for ref in coderefs], last_local_commit]
+
+
+def load_article_state(article_state):
+    """ Returns the (metadata, coderefs, last local commit) tuple for the JSON form of an
+    article's results in a saved state, or None if there's none."""
+    if None == article_state:
+        return None
+
+    metadata, coderefs, last_local_commit = article_state
+    return (ArticleMetadata.from_dict(metadata), [CodeReference.from_dict(ref) for ref in coderefs], last_local_commit)
+
+
+def save_scan_state(state_path, head, config, articles):
+    """ Saves the state of an incremental run: the docset's HEAD commit and config.json entry,
+    and articles, which maps paths in the clone to (metadata, coderefs, last local commit)
+    tuples, or None for articles without code references. Articles
+    are converted to JSON one at a time, so that they needn't all be held in memory twice."""
+    # Write to a temporary file first so an interrupted run doesn't leave a truncated state file.
+    with open(state_path + ".tmp", "w", encoding="utf-8") as state_file:
+        state_file.write(f'{{"head": {json.dumps(head)}, "config": {json.dumps(config)}, "articles": {{')
+
+        for i, (repo_path, article) in enumerate(articles.items()):
+            separator = ", " if i > 0 else ""
+            article_state = get_article_state(*article) if None != article else None
+            state_file.write(f"{separator}{json.dumps(repo_path)}: {json.dumps(article_state)}")
+
+        state_file.write("}}")
+
+    os.replace(state_path + ".tmp", state_path)
+
+
+def merge_articles(article_paths, parsed_articles, reused_articles):
+    """ Yields (path, metadata, coderefs, reports, last local commit) for each article in
+    article_paths, in order. Articles in reused_articles, which maps their paths to
+    (metadata, coderefs, last local commit) tuples from load_article_state, come from there;
+    paths that map to None have nothing to report and are skipped. Other articles come, in the
+    same order, from the parse_article results in parsed_articles, with None for the last local
+    commit."""
+    parsed_articles = iter(parsed_articles)
+
+    for full_path in article_paths:
+        if full_path in reused_articles:
+            if None != reused_articles[full_path]:
+                metadata, coderefs, last_local_commit = reused_articles[full_path]
+                yield (full_path, metadata, coderefs, [], last_local_commit)
+        else:
+            yield next(parsed_articles) + (None,)
+
+
 def line_starts_with_metadata(line, path):
     # Output warnings for these (needs to be fixed in the source)
     if line.startswith("ï»¿---"):
-        print(f"extract_coderefs, WARNING, File is not utf-8 encoded, , {path}")
+        report("WARNING", "File is not utf-8 encoded", "", path)
 
     return line.startswith("---") or line.startswith("ï»¿---")
 
+def translate_glob_segment(segment):
+    """ Translates one path segment of a docfx glob to a regular expression. * and ? don't
+    match /, [...] is a character class ([!...] negated), and {a,b} matches either a or b."""
+    result = ""
+    i = 0
+
+    while i < len(segment):
+        c = segment[i]
+
+        if c == "*":
+            result += "[^/]*"
+        elif c == "?":
+            result += "[^/]"
+        elif c == "[":
+            # As in fnmatch, a ] right after [ or [! is part of the class rather than its end.
+            end = i + 1
+
+            if segment[end:end + 1] == "!":
+                end += 1
+
+            if segment[end:end + 1] == "]":
+                end += 1
+
+            end = segment.find("]", end)
+
+            if end < 0:
+                result += re.escape(c)
+            else:
+                chars = segment[i + 1:end].replace("\\", "\\\\")
+
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                elif chars.startswith("^"):
+                    chars = "\\" + chars
+
+                result += "[" + chars + "]"
+                i = end
+        elif c == "{" and "}" in segment[i:]:
+            # Find the matching brace, allowing for nested braces
+            depth = 0
+            alternatives = []
+            start = i + 1
+
+            for end in range(i, len(segment)):
+                if segment[end] == "{":
+                    depth += 1
+                elif segment[end] == "}":
+                    depth -= 1
+
+                    if depth == 0:
+                        break
+                elif segment[end] == "," and depth == 1:
+                    alternatives.append(segment[start:end])
+                    start = end + 1
+
+            if depth != 0:
+                result += re.escape(c)
+            else:
+                alternatives.append(segment[start:end])
+                result += "(?:" + "|".join(translate_glob_segment(a) for a in alternatives) + ")"
+                i = end
+        else:
+            result += re.escape(c)
+
+        i += 1
+
+    return result
+
+
+def translate_glob(pattern):
+    """ Translates a docfx glob, relative to the docfx.json folder, to a regular expression for
+    /-separated relative paths. A ** segment matches any number of folders, including none."""
+    pattern = pattern.replace("\\", "/")
+
+    # A glob with a trailing / matches only folders, never an article.
+    if pattern.endswith("/"):
+        return "(?!)"
+
+    segments = [s for s in pattern.split("/") if s not in ("", ".")]
+    result = ""
+
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+
+        if segment == "**":
+            result += ".*" if last else "(?:.*/)?"
+        else:
+            result += translate_glob_segment(segment) + ("" if last else "/")
+
+    return result
+
+
 def get_file_metadata_globs(repo_root, file_metadata, desired_fields):
-    globs = {}
+    """ Compiles the fileMetadata globs of desired_fields into a matcher for get_file_metadata.
+    Each field's globs are combined into one regular expression whose alternatives are in
+    reverse order, so the first alternative that matches is the last matching glob in
+    docfx.json--the one that takes precedence. Matching needs no filesystem access."""
+    globs = {"root": repo_root, "fields": {}}
+
+    if None == file_metadata:
+        return globs
+
+    # Globbing is case-insensitive on Windows.
+    flags = re.IGNORECASE if os.name == "nt" else 0
 
     for field in desired_fields:
         if field in file_metadata.keys():
-            globs[field] = {}
-
-            for spec in file_metadata[field].keys():
-                folder_path = os.path.join(repo_root, spec)
-                values = {"value": file_metadata[field][spec],
-                    "glob": glob.glob(folder_path, recursive=True) }
-                globs[field][spec] = values
+            specs = list(file_metadata[field].keys())[::-1]
+            pattern = "|".join(f"({translate_glob(spec)})" for spec in specs)
+            values = [file_metadata[field][spec] for spec in specs]
+            globs["fields"][field] = (re.compile(f"(?:{pattern})\\Z", flags), values)
 
     return globs
 
@@ -92,28 +492,167 @@ def get_file_metadata(globs, file_path, desired_fields):
     metadata = {}
 
     # Retrieve metadata of interest that's assigned globally for this file within
-    # docfx.json, as represented by the file_metadata that's extracted from the JSON.
-    
+    # docfx.json, as represented by the matcher compiled from the JSON's file_metadata.
+    # Globs are relative to the docfx.json folder.
+    rel_path = os.path.relpath(file_path, globs["root"]).replace(os.sep, "/")
+
     for field in desired_fields:
-        if field in globs.keys():
-            # globs has an entry for this field, so iterate the values to 
-            # find a glob that contains the file we're working with.
+        if field in globs["fields"].keys():
+            # The group that matched identifies the glob, and thereby the value, that applies.
+            pattern, values = globs["fields"][field]
+            match = pattern.match(rel_path)
 
-            for spec in globs[field].keys():
-                if file_path in globs[field][spec]["glob"]:
-                    # Found a matching path for the file, so record the value. We keep processing
-                    # because there may be multiple entries that work, and we always want to use
-                    # the last one in the list, which is more specific than earlier globs.
-                    metadata[field] = globs[field][spec]["value"]
+            if None != match:
+                metadata[field] = values[match.lastindex - 1]
 
     return metadata
 
 
+def get_exclude_folders_pattern(exclude_folders):
+    """ Compiles the exclude_folders of a docset into one regular expression for folder paths
+    relative to the docset folder, with / separators. An entry without a / is a glob for a
+    folder name at any level, such as "media" or "media*"; an entry with a / is a docfx-style
+    glob for folder paths, such as "articles/**/includes". Returns None if nothing is excluded."""
+    if None == exclude_folders or len(exclude_folders) == 0:
+        return None
+
+    patterns = []
+
+    for exclusion in exclude_folders:
+        if "/" in exclusion.replace("\\", "/").strip("/"):
+            patterns.append(translate_glob(exclusion.strip("/\\")))
+        else:
+            patterns.append("(?:.*/)?" + translate_glob_segment(exclusion.strip("/\\")))
+
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    return re.compile("(?:" + "|".join(patterns) + ")\\Z", flags)
+
+
+def get_content_globs(build_content):
+    """ Compiles the files and exclude globs of each build.content entry in docfx.json into a
+    list of (src folder, files pattern, exclude pattern) tuples for is_docfx_content."""
+    content_globs = []
+    flags = re.IGNORECASE if os.name == "nt" else 0
+
+    for entry in build_content or []:
+        src = "/".join(s for s in entry.get("src", "").replace("\\", "/").split("/") if s not in ("", "."))
+        patterns = []
+
+        for key in ("files", "exclude"):
+            specs = entry.get(key) or []
+            specs = [specs] if isinstance(specs, str) else specs
+            patterns.append(re.compile("(?:" + "|".join(translate_glob(spec) for spec in specs) + ")\\Z", flags) if len(specs) > 0 else None)
+
+        content_globs.append((src, patterns[0], patterns[1]))
+
+    return content_globs
+
+
+def is_docfx_content(content_globs, rel_path):
+    """ Returns whether rel_path, relative to the docfx.json folder with / separators, is among
+    the files of any build.content entry and not among that entry's exclusions."""
+    for src, files, exclude in content_globs:
+        path = rel_path
+
+        if len(src) > 0:
+            if not path.startswith(src + "/"):
+                continue
+
+            path = path[len(src) + 1:]
+
+        if None != files and files.match(path) and (None == exclude or not exclude.match(path)):
+            return True
+
+    return False
+
+
+def list_git_articles(folder):
+    """ Returns the paths of the .md files under folder that git tracks, relative to folder with /
+    separators, from the index alone; or None if folder isn't in a git repository."""
+    profile.count("git_invocations")
+    p = Popen(["git", "ls-files", "-z", "--", "*.md"], cwd=folder, stdout=PIPE, stderr=PIPE)
+    out, _ = p.communicate()
+
+    if 0 != p.returncode:
+        return None
+
+    # The *.md pathspec matches in subfolders, too, as * in a pathspec also matches /.
+    return [path for path in out.decode("utf-8", "replace").split("\0") if len(path) > 0]
+
+
+def scan_articles(folder, excluded, rel_folder=""):
+    """ Returns the paths of the .md files under folder, relative to folder with / separators,
+    without descending into folders that match excluded, the pattern from
+    get_exclude_folders_pattern. Directory entries carry their type, so files needn't be stat'ed."""
+    paths = []
+
+    with os.scandir(os.path.join(folder, rel_folder)) as entries:
+        for entry in entries:
+            rel_path = rel_folder + "/" + entry.name if len(rel_folder) > 0 else entry.name
+
+            if entry.is_dir():
+                if not entry.is_symlink() and (None == excluded or None == excluded.match(rel_path)):
+                    paths.extend(scan_articles(folder, excluded, rel_path))
+            elif entry.name.endswith(".md"):
+                paths.append(rel_path)
+
+    return paths
+
+
+def enumerate_articles(folder, exclude_folders=None, docfx_folder=None, content_globs=None):
+    """ Returns the sorted full paths of the articles in a docset folder: the .md files that git
+    tracks, or in a folder outside git, those found by scanning it. Files in folders that match
+    exclude_folders are left out, and with content_globs (from get_content_globs), so are files
+    that aren't part of the docfx build in docfx_folder."""
+    excluded = get_exclude_folders_pattern(exclude_folders)
+    rel_paths = list_git_articles(folder)
+
+    if None == rel_paths:
+        rel_paths = scan_articles(folder, excluded)
+    elif None != excluded:
+        # Whether each folder is excluded, as many files share a folder
+        excluded_folders = {"": False}
+
+        def is_excluded(rel_folder):
+            if not rel_folder in excluded_folders:
+                parent = rel_folder.rsplit("/", 1)[0] if "/" in rel_folder else ""
+                excluded_folders[rel_folder] = is_excluded(parent) or None != excluded.match(rel_folder)
+
+            return excluded_folders[rel_folder]
+
+        rel_paths = [path for path in rel_paths if not is_excluded(path.rsplit("/", 1)[0] if "/" in path else "")]
+
+    if None != content_globs:
+        docfx_prefix = os.path.relpath(docfx_folder, folder).replace(os.sep, "/")
+        docfx_prefix = "" if docfx_prefix == "." else docfx_prefix + "/"
+        rel_paths = [path for path in rel_paths if path.startswith(docfx_prefix)
+            and is_docfx_content(content_globs, path[len(docfx_prefix):])]
+
+    return sorted(os.path.join(folder, *path.split("/")) for path in rel_paths)
+
+
+# The line boundaries of str.splitlines
+LINE_BREAK = re.compile("\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+def iter_lines(content):
+    """ Yields the lines of content one at a time, as str.splitlines would split them, without
+    splitting all of it up front, for when only the first few lines are needed."""
+    start = 0
+
+    for line_break in LINE_BREAK.finditer(content):
+        yield content[start:line_break.start()]
+        start = line_break.end()
+
+    if start < len(content):
+        yield content[start:]
+
+
 def extract_metadata_fields(content, repo_root, file_path, globs, desired_fields):    
     saw_first_metadata_header = False
     metadata = {}
     
-    for line in iter(content.splitlines(0)):
+    # The metadata header is at the top of the file, so read lines only until its end.
+    for line in iter_lines(content):
         # Ignore any comments or blank lines in the metadata header
         if line.startswith("#") or len(line) == 0:
             continue
@@ -163,17 +702,95 @@ def extract_metadata_fields(content, repo_root, file_path, globs, desired_fields
 
     return metadata
 
-def strip_quotes(item):
-    return item.strip('"')
+def parse_article(full_path, docfx_folder, globs, desired_fields, repo_data):
+    """ Reads an article and returns a tuple of its path, metadata, external code references,
+    and the diagnostics reported along the way; metadata and references are None if the file
+    can't be read. This is the per-article work that --jobs spreads across processes."""
+    with collect_reports() as reports:
+        try:
+            content = pathlib.Path(full_path).read_text(errors="replace")
+        except FileNotFoundError:
+            # Articles are listed from the git index, which can include files deleted since.
+            report("WARNING", "Skipping file that no longer exists", "", full_path)
+            return (full_path, None, None, reports)
+        except UnicodeDecodeError:
+            report("WARNING", "Skipping file that contains non-UTF-8 characters and should be converted", "", full_path)
+            return (full_path, None, None, reports)
+
+        # TODO: add --verbose flag (with levels, perhaps) to include this message
+        # report("INFO", "Processing file", "", full_path)
+
+        metadata = extract_metadata_fields(content, docfx_folder, full_path, globs, desired_fields)
+
+        # Content check: if metadata is empty, then the article lacks metadata, but this 
+        # isn't a blocking problem.                
+        if None == metadata or len(metadata) == 0:
+            report("WARNING", "File contains no metadata", "", full_path)
+
+        coderefs = find_external_code_refs(content, repo_data)
+
+    return (full_path, ArticleMetadata.from_dict(metadata), coderefs, reports)
+
+
+def intern_string(value):
+    """ Returns the interned copy of value, or value itself if it isn't a string (such as None)."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ArticleMetadata(collections.namedtuple("ArticleMetadata", ["service", "subservice", "author", "reviewer", "date"])):
+    """ The ms.service, ms.subservice, ms.author, ms.reviewer, and ms.date metadata of an article
+    (date is None if the article has none). The values repeat across many articles, so they're
+    interned; that includes records unpickled from the processes of --jobs."""
+    __slots__ = ()
+
+    def __new__(cls, service, subservice, author, reviewer, date):
+        return super().__new__(cls, intern_string(service), intern_string(subservice),
+            intern_string(author), intern_string(reviewer), intern_string(date))
+
+    @classmethod
+    def from_dict(cls, metadata):
+        """ Returns the record for a dictionary of metadata fields, as from
+        extract_metadata_fields or a saved scan state."""
+        return cls(metadata.get("ms.service"), metadata.get("ms.subservice"), metadata.get("ms.author"),
+            metadata.get("ms.reviewer"), metadata.get("ms.date"))
+
+    def as_dict(self):
+        return {"ms.service": self.service, "ms.subservice": self.subservice, "ms.author": self.author,
+            "ms.reviewer": self.reviewer, "ms.date": self.date}
+
+
+class CodeReference(collections.namedtuple("CodeReference", ["line", "type", "detail", "repo", "branch", "file_in_repo", "file_url"])):
+    """ An external code reference in an article: its line, type ("id", "range", or
+    "whole_file") and detail, and the repo URL, branch, path in the repo, and GitHub URL of the
+    referenced file. The last four are None if the reference's repo isn't among the docset's
+    dependent repositories. Strings are interned, as for ArticleMetadata."""
+    __slots__ = ()
+
+    def __new__(cls, line, type, detail, repo=None, branch=None, file_in_repo=None, file_url=None):
+        return super().__new__(cls, line, intern_string(type), intern_string(detail), intern_string(repo),
+            intern_string(branch), intern_string(file_in_repo), intern_string(file_url))
+
+    @classmethod
+    def from_dict(cls, ref):
+        """ Returns the record for a code reference saved in a scan state."""
+        return cls(ref["line"], ref["type"], ref["detail"], ref.get("repo"), ref.get("branch"),
+            ref.get("file_in_repo"), ref.get("file_url"))
+
+    def as_dict(self):
+        return {key: value for key, value in self._asdict().items() if None != value}
+
 
 def code_string_to_dict(code_string):
-    result = []
+    """ Returns the name="value" properties of a :::code directive as a dictionary."""
+    result = {}
 
     for sub in code_string.split():
-        if "=" in sub:
-            result.append(map(strip_quotes, sub.split("=", 1)))
+        name, equals, value = sub.partition("=")
+
+        if equals:
+            result[name.strip('"')] = value.strip('"')
 
-    return dict(result)
+    return result
 
 
 def map_repo(source_path, repo_data):
@@ -184,13 +801,25 @@ def map_repo(source_path, repo_data):
     
     return None
 
+# A :::code directive, which must start the line; group 1 is the directive's properties.
+code_directive = re.compile("(?::::code)(.*)(?::::)")
+
 def find_external_code_refs(content, repo_data):
     results = []
     line_num = 0
 
+    # Most articles have no :::code directives at all, which a single search of the whole
+    # content can tell us without splitting it into lines.
+    if not ":::code" in content:
+        return results
+
     for line in iter(content.splitlines(0)):        
         line_num += 1
-        match = re.match("(?::::code)(.*)(?::::)", line)
+
+        if not line.startswith(":::code"):
+            continue
+
+        match = code_directive.match(line)
 
         if None == match:
             continue
@@ -214,20 +843,16 @@ def find_external_code_refs(content, repo_data):
             source_parts[1] = parts2[0]
             source_parts[2] = parts2[1]
         
-        # Now we can build the full return list
-        result = {}
-        result["line"] = line_num
-        result.update(props)
-        
+        # Now we can build the reference, keeping only the properties that the results use.
         if "id" in props.keys():
-            result["type"] = "id"
-            result["detail"] = props["id"]
+            type = "id"
+            detail = props["id"]
         elif "range" in props.keys():
-            result["type"] = "range"
-            result["detail"] = "'" + props["range"] + "'"  # Quoted to avoid becoming a date in Excel
+            type = "range"
+            detail = "'" + props["range"] + "'"  # Quoted to avoid becoming a date in Excel
         else:
-            result["type"] = "whole_file"
-            result["detail"] = ""
+            type = "whole_file"
+            detail = ""
 
         # Because we have a ~/ source reference, source_parts[1] is the repo ID and
         # source_parts[2] is the relative path within that repo. To complete the full
@@ -239,19 +864,15 @@ def find_external_code_refs(content, repo_data):
         repo = map_repo(source_parts[1], repo_data)
 
         if None != repo:
-            result["file_url"] = f'{repo["url"]}/blob/{repo["branch"]}/{source_parts[2]}'
-
-            # Add these for good measure
-            result["repo"] = repo["url"]
-            result["branch"] = repo["branch"]
-            result["file_in_repo"] = source_parts[2]
-
-        results.append(result)
+            file_url = f'{repo["url"]}/blob/{repo["branch"]}/{source_parts[2]}'
+            results.append(CodeReference(line_num, type, detail, repo["url"], repo["branch"], source_parts[2], file_url))
+        else:
+            results.append(CodeReference(line_num, type, detail))
 
     return results
 
 
-def get_commit_history(file_url, commit_cache, start_date=None, start_date_local=None):
+def get_file_key(file_url):
     # Source URLs are of the form:
     #     https://github.com/{owner}/{repo}/blob/{branch}/{path}
     #     
@@ -263,6 +884,21 @@ def get_commit_history(file_url, commit_cache, start_date=None, start_date_local
     # For example:
     #     https://github.com/Azure-Samples/functions-quickstarts-java/blob/master/functions-add-output-binding-storage-queue/src/main/java/com/function/Function.java
     #
+    # Returns the normalized (owner, repo, branch, path) tuple that identifies the file, so that
+    # references that spell the same file differently share one commit history lookup. Owner and
+    # repo names are case-insensitive on GitHub; empty and "." path segments are dropped. Returns
+    # None if file_url doesn't match the expected pattern.
+    re_url = "https:\/\/github\.com\/([^\/.]+)*\/([^\/.]+)*\/blob\/([^\/.]+)*\/(.+)"
+    match = re.match(re_url, file_url)
+
+    if None == match:
+        return None
+
+    path = "/".join(segment for segment in match.group(4).split("/") if segment not in ("", "."))
+    return (match.group(1).lower(), match.group(2).lower(), match.group(3), path)
+
+
+def get_history_url(file_key, since=None, per_page=None, until=None):
     # Commit history for the file is:
     #     https://api.github.com/repos/{owner}/{repo}/commits?sha={branch}&path={path}
     #
@@ -271,69 +907,94 @@ def get_commit_history(file_url, commit_cache, start_date=None, start_date_local
     #    
     # Need to assume public repos (as samples generally are) otherwise we run into auth issues.
     #
-    dates = []
-    commits_since_start = 0
-    commits_since_local = 0
-    most_recent = ""
-    most_recent_url = ""
-    
-    if None != start_date:
-        # Assume start_date is in ms.date format
-        dt_start = datetime.strptime(start_date, "%m/%d/%Y")
-    else:
-        # Some ridiculously early date for sample code--Microsoft's founding date. :)
-        dt_start = datetime(1975, 4, 4)
+    # since is a day ordinal; the API then returns only commits from the start of that day (UTC)
+    # onward. until is likewise a day ordinal, for commits up to the end of that day. per_page
+    # sets the page size, which is 30 by default and at most 100.
+    owner, repo, branch, path = file_key
+    url = f"{API_URL}/repos/{owner}/{repo}/commits?sha={branch}&path={path}"
 
-    if None != start_date_local:
-        dt_local = datetime.strptime(start_date_local, "%m/%d/%Y")
-    else:
-        dt_local = datetime(1975, 4, 4)
+    if None != per_page:
+        url += f"&per_page={per_page}"
 
+    if None != since:
+        url += "&since=" + datetime.fromordinal(since).strftime("%Y-%m-%dT00:00:00Z")
 
-    re_url = "https:\/\/github\.com\/([^\/.]+)*\/([^\/.]+)*\/blob\/([^\/.]+)*\/(.+)"
-    match = re.match(re_url, file_url)
+    if None != until:
+        url += "&until=" + datetime.fromordinal(until).strftime("%Y-%m-%dT23:59:59Z")
 
-    if None == match:
-        print(f"extract_coderefs, WARNING, GitHub file URL does not match expected pattern, , {file_url}")
-        return None
-    
-    history_url = f"https://api.github.com/repos/{match.group(1)}/{match.group(2)}/commits?sha={match.group(3)}&path={match.group(4)}"
+    return url
 
-    if not history_url in commit_cache.keys():
-        user = os.getenv("GITHUB_USER")
-        token = os.getenv("GITHUB_ACCESS_TOKEN")
 
-        response = requests.get(history_url, auth = HTTPBasicAuth(user, token))
+class CommitSummary(NamedTuple):
+    """ A file's commit history as get_commit_history needs it: the sorted day ordinals of its
+    commits, and the date (mm/dd/yyyy) and URL of the most recent."""
+    dates: tuple
+    most_recent: str
+    most_recent_url: str
 
-        if response.status_code == 200:
-            response_data = response.json()
-            commit_cache.update({ history_url: response_data })
-        else:
-            print(f"extract_coderefs, ERROR, Failed to get commit history, {history_url}, {file_url}")
-            return None
 
-    else:
-        response_data = commit_cache[history_url]
+def summarize_commit_history(response_data):
+    """ Reduces a list of commits from the GitHub API to a CommitSummary."""
+    dates = []
+    most_recent = ""
+    most_recent_url = ""
 
-    # Extract all the commit dates that are after the start date (not on the start date, as samples
-    # and articles are often updated together).
     for commit in response_data:
         date = commit["commit"]["author"]["date"]
         dt = datetime.strptime(date, "%Y-%m-%dT%H:%M:%SZ")
-        
+
         if "" == most_recent:
             most_recent = dt.strftime('%m/%d/%Y')
             most_recent_url = commit["html_url"]
 
-        if (dt.date() > dt_start.date()):
-            commits_since_start += 1
+        dates.append(dt.toordinal())
+
+    dates.sort()
+
+    # Many files were last changed by the same commits, on the same dates.
+    return CommitSummary(tuple(dates), sys.intern(most_recent), sys.intern(most_recent_url))
+
+
+@functools.lru_cache(maxsize=None)
+def date_ordinal(date_string):
+    """ Returns the day ordinal of an mm/dd/yyyy date string such as ms.date; None gives some
+    ridiculously early date for sample code--Microsoft's founding date. :)"""
+    if None == date_string:
+        return datetime(1975, 4, 4).toordinal()
+
+    return datetime.strptime(date_string, "%m/%d/%Y").toordinal()
+
+
+def get_history_since(start_date=None, start_date_local=None):
+    """ Returns the day ordinal of the earlier of the two dates that get_commit_history counts
+    commits from; no earlier commit can affect its counts."""
+    return min(date_ordinal(start_date), date_ordinal(start_date_local))
+
+
+def get_commit_history(file_url, github_client, start_date=None, start_date_local=None):
+    # github_client fetches (or has already fetched in the background) the file's commit history,
+    # already summarized by summarize_commit_history. Dates are in ms.date format.
+    file_key = get_file_key(file_url)
+
+    if None == file_key:
+        report("WARNING", "GitHub file URL does not match expected pattern", "", file_url)
+        return None
+
+    with profile.stage("wait_commit_history"):
+        history = github_client.get(file_key)
+
+    if None == history:
+        report("ERROR", "Failed to get commit history", get_history_url(file_key), file_url)
+        return None
 
-        if (dt.date() > dt_local.date()):
-            commits_since_local += 1
+    # Count the commits that are after the start date (not on the start date, as samples and
+    # articles are often updated together). The dates are sorted, so these are the commits
+    # to the right of the start date.
+    dates = history.dates
 
     return {
-        "commits_since_start": commits_since_start,
-        "commits_since_local": commits_since_local,
-        "most_recent": most_recent,
-        "most_recent_url": most_recent_url
-    }    
+        "commits_since_start": len(dates) - bisect.bisect_right(dates, date_ordinal(start_date)),
+        "commits_since_local": len(dates) - bisect.bisect_right(dates, date_ordinal(start_date_local)),
+        "most_recent": history.most_recent,
+        "most_recent_url": history.most_recent_url
+    }